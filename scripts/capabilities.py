@@ -1,8 +1,20 @@
 # capabilities.py
 # Defines tool schemas for the ThoughtProcessor.
 
-def get_tool_schemas():
-    """Returns a list of all tool schemas available to Gen."""
+# Tools whose full schema is always sent, regardless of what was used before.
+CORE_TOOL_NAMES = ("respond_to_user", "inquire_for_details")
+
+# Likely next tools after each tool, sent in full alongside the core tools and the tool just used.
+# None promotes every tool; tools missing from this map also promote every tool.
+FOLLOW_UP_TOOL_NAMES = {
+    "overthink_input": None,
+    "perform_web_search": None,  # Search results can feed any tool
+    "store_knowledge": ("perform_web_search", "overthink_input"),
+    "generate_image": ("store_knowledge",),
+}
+
+def _build_tool_schemas():
+    """Builds the full list of tool schemas available to Gen."""
     return [
         {
             "type": "function",
@@ -94,3 +106,38 @@ def get_tool_schemas():
             }
         }
     ]
+
+# Built once at import and shared by every caller, so they go into LLM payloads without copying.
+# Treat them as constants: never mutate a schema or anything nested in it.
+_TOOL_SCHEMAS = tuple(_build_tool_schemas())
+_SCHEMAS_BY_NAME = {s["function"]["name"]: s for s in _TOOL_SCHEMAS}
+
+def get_tool_schemas():
+    """Returns a tuple of all tool schemas available to Gen. The schemas are shared; do not mutate them."""
+    return _TOOL_SCHEMAS
+
+def get_tool_schema(name):
+    """Returns the full schema for a single tool, or None if it is unknown."""
+    return _SCHEMAS_BY_NAME.get(name)
+
+def get_tool_summaries():
+    """Returns a short name + summary entry for every tool, used as the always-resident tool index."""
+    return [
+        {"name": name, "summary": schema["function"]["description"].split(". ")[0].rstrip(".") + "."}
+        for name, schema in _SCHEMAS_BY_NAME.items()
+    ]
+
+def get_active_tool_schemas(previous_tool_name=None):
+    """
+    Returns the full schemas to promote for the next LLM turn.
+    With no previous decision every tool is promoted; afterwards the core tools, the tool
+    that was just used and its FOLLOW_UP_TOOL_NAMES are sent in full.
+    """
+    if previous_tool_name is None or previous_tool_name not in _SCHEMAS_BY_NAME:
+        return _TOOL_SCHEMAS
+    follow_ups = FOLLOW_UP_TOOL_NAMES.get(previous_tool_name)
+    if follow_ups is None:
+        return _TOOL_SCHEMAS
+    active = {*CORE_TOOL_NAMES, previous_tool_name, *follow_ups}
+    # Keep the canonical schema order so the payload prefix stays stable between turns
+    return [schema for name, schema in _SCHEMAS_BY_NAME.items() if name in active]
@@ -2,15 +2,18 @@
 
 import os
 import logging
+import functools
+import itertools
+import time
 import discord
 import re
 import json
+import orjson
 from pathlib import Path
-from datetime import datetime, timezone as dt_timezone, timedelta
-import pytz
+from zoneinfo import ZoneInfo
 import asyncio
 
-from thought_processor import ThoughtProcessor
+from thought_processor import ThoughtProcessor, CURRENT_TIME_PLACEHOLDER
 from user_profiles import UserProfileManager
 from knowledge_graph import Neo4jManager
 from media_manager import MediaManager
@@ -18,13 +21,32 @@ from web_search import WebSearchManager
 from database_manager import DatabaseManager
 from tinygen_controller import TinyGenController
 from history_manager import HistoryManager
-
-import sentencepiece as spm
+from message_queue import ChannelPartitionedQueue
+from tokenizer_provider import TokenizerProvider, get_tokenizer_provider
+import capabilities
 
 thought_logger = logging.getLogger('thought')
 dev_logger = logging.getLogger('dev')
 neo4j_logger = logging.getLogger('neo4j')
 
+_ALIAS_PATTERNS = [
+    re.compile(r"(?:call\s+me|my\s+name\s+is|i\s+want\s+to\s+be\s+called)\s+([\w\s'-]+)", re.IGNORECASE)
+]
+
+# Last successfully parsed gen_profile.json, served stale if a later re-read fails.
+_last_good_gen_profile: dict = {}
+
+@functools.lru_cache(maxsize=1)
+def _read_gen_profile(path: str, mtime_ns: int) -> dict:
+    """Parses gen_profile.json. Cached on (path, mtime) so an unchanged file is never re-parsed."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+# Below this many characters the len // 4 heuristic is used instead of running the tokenizer.
+SHORT_TEXT_TOKENIZE_THRESHOLD = 32
+# Gen's own replies are typically short confirmations, so a higher cut-off applies to them.
+ASSISTANT_TOKENIZE_THRESHOLD = 256
+
 class ConversationManager:
     def __init__(self,
                  user_profile_manager: UserProfileManager,
@@ -33,7 +55,8 @@ class ConversationManager:
                  web_search_manager: WebSearchManager,
                  database_manager: DatabaseManager,
                  tinygen_controller: TinyGenController,
-                 message_queue: asyncio.Queue): # Modified
+                 message_queue: ChannelPartitionedQueue, # Modified
+                 tokenizer_provider: TokenizerProvider = None):
 
         self.user_profile_manager = user_profile_manager
         self.neo4j_manager = neo4j_manager
@@ -42,16 +65,18 @@ class ConversationManager:
         self.database_manager = database_manager
         self.tinygen_controller = tinygen_controller
         self.message_queue = message_queue # New
+        self.tokenizer_provider = tokenizer_provider or get_tokenizer_provider()
 
         self.thought_processor = ThoughtProcessor(
             media_manager=self.media_manager,
             web_search_manager=self.web_search_manager,
-            user_profile_manager=self.user_profile_manager
+            user_profile_manager=self.user_profile_manager,
+            tokenizer_provider=self.tokenizer_provider
         )
 
         self.gen_profile_path = Path("data/gen_profile.json")
         self.gen_profile = self._load_gen_profile()
-        self.timezone = pytz.timezone(os.getenv('TIMEZONE', 'UTC'))
+        self.timezone = ZoneInfo(os.getenv('TIMEZONE', 'UTC'))
         self.gen_name = self.gen_profile.get('name', 'Gen')
 
         self.history_primary_fetch_limit = int(os.getenv('HISTORY_PRIMARY_FETCH_LIMIT', "30"))
@@ -62,17 +87,16 @@ class ConversationManager:
         self.MAX_TOOL_ITERATIONS = 12
 
         self.bot_user_id = None
-        self.known_public_channel_ids: list[str] = []
+        # Shared with HistoryManager, so it is only ever mutated in place
         self.channel_name_map: dict[str, str] = {}
 
         self._initialize_gen_profile()
-        self._initialize_tokenizer()
 
         self.history_manager = HistoryManager(
             neo4j_manager=self.neo4j_manager,
             user_profile_manager=self.user_profile_manager,
             thought_processor=self.thought_processor,
-            tokenizer=self.tokenizer,
+            tokenizer_provider=self.tokenizer_provider,
             channel_name_map=self.channel_name_map,
             bot_user_id=self.bot_user_id
         )
@@ -80,12 +104,11 @@ class ConversationManager:
         dev_logger.debug("ConversationManager initialized.")
 
     def _initialize_gen_profile(self):
-        date_format = "%A, %B %d, %Y, %H:%M %Z"
-        current_time_str = datetime.now(self.timezone).strftime(date_format)
+        # The time is left as a placeholder; ThoughtProcessor fills it in right before each LLM call.
         main_system_prompt_for_tp = (
             f"You are {self.gen_name}, a {self.gen_profile.get('personality', 'fiery, playful, and moody')}. "
             f"Your appearance is: {self.gen_profile.get('appearance', 'steampunk style with red hair')}. You were born on {self.gen_profile.get('birthdate', 'March 15, 1992')}. "
-            f"Its {current_time_str}. "
+            f"Its {CURRENT_TIME_PLACEHOLDER}. "
         )
         self.thought_processor.set_gen_profile(
             name=self.gen_name,
@@ -95,76 +118,103 @@ class ConversationManager:
             main_system_prompt=main_system_prompt_for_tp
         )
 
-    def _initialize_tokenizer(self):
-        self.tokenizer = None
-        try:
-            tokenizer_model_path = Path(os.getenv('TOKENIZER_MODEL_PATH', 'models/tokenizer.model'))
-            if tokenizer_model_path.exists():
-                self.tokenizer = spm.SentencePieceProcessor()
-                self.tokenizer.load(str(tokenizer_model_path))
-                dev_logger.info(f"ConversationManager: SentencePiece tokenizer loaded from {tokenizer_model_path}.")
-            else:
-                dev_logger.warning(f"ConversationManager: Tokenizer model not found at '{tokenizer_model_path}'. Token counts will be estimated.")
-        except Exception as e:
-            dev_logger.error(f"ConversationManager: Failed to load SentencePiece tokenizer: {e}. Token counts will be estimated.", exc_info=True)
+    @property
+    def tokenizer(self):
+        return self.tokenizer_provider.tokenizer
 
     def set_bot_user_id(self, bot_user_id: str):
         self.bot_user_id = str(bot_user_id)
         self.thought_processor.set_bot_user_id(self.bot_user_id)
+        self.history_manager.bot_user_id = self.bot_user_id
         dev_logger.info(f"ConversationManager: bot_user_id set to {self.bot_user_id}")
 
+    @property
+    def known_public_channel_ids(self) -> list[str]:
+        return list(self.channel_name_map)
+
     def set_channel_name_map(self, id_to_name_map: dict[str, str]):
-        self.channel_name_map = id_to_name_map
-        self.known_public_channel_ids = list(id_to_name_map.keys())
+        self.channel_name_map.clear()
+        self.channel_name_map.update(id_to_name_map)
         dev_logger.info(f"ConversationManager: Channel name map set. Count: {len(self.channel_name_map)}")
 
+    def update_channel_names(self, id_to_name_map: dict[str, str], removed_channel_ids=()):
+        """Applies incremental channel changes (from gateway events) to the shared channel name map."""
+        for channel_id in removed_channel_ids:
+            self.channel_name_map.pop(channel_id, None)
+        self.channel_name_map.update(id_to_name_map)
+        dev_logger.debug(f"ConversationManager: Channel name map updated. Count: {len(self.channel_name_map)}")
+
     def _load_gen_profile(self):
+        global _last_good_gen_profile
         try:
             if self.gen_profile_path.exists():
-                with open(self.gen_profile_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                mtime_ns = self.gen_profile_path.stat().st_mtime_ns
+                _last_good_gen_profile = _read_gen_profile(str(self.gen_profile_path), mtime_ns)
+                return _last_good_gen_profile
             return {}
         except Exception as e:
-            dev_logger.error(f"Error loading gen_profile.json: {e}", exc_info=True)
-            return {}
+            dev_logger.error(f"Error loading gen_profile.json: {e}. Using last known profile.", exc_info=True)
+            return _last_good_gen_profile
+
+    def _count_tokens(self, content: str, role: str = "user") -> int:
+        """Token count for storage. SentencePiece has no count-only API, so short texts skip it entirely."""
+        threshold = ASSISTANT_TOKENIZE_THRESHOLD if role == "assistant" else SHORT_TEXT_TOKENIZE_THRESHOLD
+        if not self.tokenizer or len(content) < threshold:
+            return len(content) // 4
+        return len(self.tokenizer.encode(content))
+
+    def _message_node_row(self, discord_message_object: discord.Message, role: str,
+                          interaction_id_for_message: str, content_to_store: str = None) -> dict:
+        """Keyword arguments for Neo4jManager.create_message_node / create_message_nodes_batch."""
+        content = content_to_store if content_to_store is not None else discord_message_object.content
+        return dict(
+            message_id=str(discord_message_object.id), author_user_id=str(discord_message_object.author.id),
+            interaction_id=interaction_id_for_message, channel_id=str(discord_message_object.channel.id),
+            role=role, content_to_store=content,
+            timestamp=int(discord_message_object.created_at.timestamp()), token_count=self._count_tokens(content, role),
+            length_chars=len(content), has_attachments=bool(discord_message_object.attachments)
+        )
 
     async def _store_message_in_neo4j(self, discord_message_object: discord.Message, role: str,
                                       interaction_id_for_message: str, content_to_store: str = None):
         if not self.neo4j_manager: return
         try:
-            content = content_to_store if content_to_store is not None else discord_message_object.content
-            token_count = len(self.tokenizer.encode(content)) if self.tokenizer else len(content) // 4
             await self.neo4j_manager.create_message_node(
-                message_id=str(discord_message_object.id), author_user_id=str(discord_message_object.author.id),
-                interaction_id=interaction_id_for_message, channel_id=str(discord_message_object.channel.id),
-                is_dm=isinstance(discord_message_object.channel, discord.DMChannel), role=role, content_to_store=content,
-                timestamp=int(discord_message_object.created_at.replace(tzinfo=dt_timezone.utc).timestamp()), token_count=token_count,
-                length_chars=len(content), has_attachments=bool(discord_message_object.attachments)
+                **self._message_node_row(discord_message_object, role, interaction_id_for_message, content_to_store)
             )
         except Exception as e:
             dev_logger.error(f"Failed to store {role} message ID {discord_message_object.id} in Neo4j: {e}", exc_info=True)
 
+    async def _analyze_one_attachment(self, attachment: discord.Attachment, message: discord.Message, interaction_id: str, interaction_timestamp: int) -> str:
+        attachment_summary_prefix = f"[Attachment: {attachment.filename} - Type: {attachment.content_type} - "
+        try:
+            image_data = await attachment.read()
+            vision_prompt = f"Describe this image. The user who sent it (named '{message.author.display_name}') also wrote: '{message.content}'"
+            description = await self.media_manager.analyze_image(image_data=image_data, prompt=vision_prompt)
+            if description and description.strip():
+                await self.neo4j_manager.insert_action(interaction_id, str(message.channel.id), "AnalyzeImageAttachment", interaction_timestamp, f"User sent image: {attachment.filename}", result_summary=description.strip()[:250])
+                return f"{attachment_summary_prefix}Summary: {description.strip()}]"
+            return f"{attachment_summary_prefix}Could not get a description.]"
+        except Exception as e_vision:
+            dev_logger.error(f"Error analyzing image attachment '{attachment.filename}': {e_vision}", exc_info=True)
+            return f"{attachment_summary_prefix}Error during analysis.]"
+
     async def _handle_attachments(self, message: discord.Message, initial_content: str, interaction_id: str, interaction_timestamp: int) -> str:
-        appended_texts = []
-        if not message.attachments:
+        # Only images are processed; other attachment types are skipped without a placeholder.
+        image_attachments = [a for a in message.attachments if a.content_type and a.content_type.startswith("image/")]
+        if not image_attachments:
             return initial_content
-        for attachment in message.attachments:
-            attachment_summary_prefix = f"[Attachment: {attachment.filename} - Type: {attachment.content_type} - "
-            if attachment.content_type and attachment.content_type.startswith("image/"):
-                try:
-                    image_data = await attachment.read()
-                    vision_prompt = f"Describe this image. The user who sent it (named '{message.author.display_name}') also wrote: '{message.content}'"
-                    description = await self.media_manager.analyze_image(image_data=image_data, prompt=vision_prompt)
-                    if description and description.strip():
-                        appended_texts.append(f"{attachment_summary_prefix}Summary: {description.strip()}]")
-                        await self.neo4j_manager.insert_action(interaction_id, str(message.channel.id), "AnalyzeImageAttachment", interaction_timestamp, f"User sent image: {attachment.filename}", result_summary=description.strip()[:250])
-                    else:
-                        appended_texts.append(f"{attachment_summary_prefix}Could not get a description.]")
-                except Exception as e_vision:
-                    dev_logger.error(f"Error analyzing image attachment '{attachment.filename}': {e_vision}", exc_info=True)
-                    appended_texts.append(f"{attachment_summary_prefix}Error during analysis.]")
-            else:
-                appended_texts.append(f"{attachment_summary_prefix}Processing not yet implemented for this type.]")
+        # Analyze all images concurrently; results keep the attachment order.
+        results = await asyncio.gather(
+            *(self._analyze_one_attachment(attachment, message, interaction_id, interaction_timestamp) for attachment in image_attachments),
+            return_exceptions=True
+        )
+        appended_texts = []
+        for attachment, result in zip(image_attachments, results):
+            if isinstance(result, BaseException):
+                dev_logger.error(f"Unexpected error handling attachment '{attachment.filename}': {result}", exc_info=result)
+                continue
+            appended_texts.append(result)
         if appended_texts:
             separator = "\n" if initial_content.strip() else ""
             return f"{initial_content}{separator}" + "\n".join(appended_texts).strip()
@@ -182,9 +232,8 @@ class ConversationManager:
         return False
 
     def is_alias_change_request(self, message_text: str) -> str | None:
-        patterns = [r"(?:call\s+me|my\s+name\s+is|i\s+want\s+to\s+be\s+called)\s+([\w\s'-]+)"]
-        for pattern in patterns:
-            match = re.search(pattern, message_text, re.IGNORECASE)
+        for pattern in _ALIAS_PATTERNS:
+            match = pattern.search(message_text)
             if match:
                 new_alias = match.group(1).strip()
                 if 0 < len(new_alias) < 50 and new_alias.lower() != self.gen_name.lower():
@@ -193,60 +242,94 @@ class ConversationManager:
 
     def _get_channel_ids_for_priority_fetch(self, current_message: discord.Message) -> set[str]:
         priority_channel_ids = {str(current_message.channel.id)}
-        user_profile = self.neo4j_manager.get_user(str(current_message.author.id))
+        author_id = str(current_message.author.id)
+        # Author and bot profiles are fetched together in a single round trip
+        profiles = self.neo4j_manager.get_users([author_id, self.bot_user_id] if self.bot_user_id else [author_id])
+        user_profile = profiles.get(author_id)
         if user_profile:
             if user_profile.get('dm_channel_id'): priority_channel_ids.add(user_profile['dm_channel_id'])
             if user_profile.get('last_active_channel_id'): priority_channel_ids.add(user_profile['last_active_channel_id'])
         if self.bot_user_id:
-            bot_profile = self.neo4j_manager.get_user(self.bot_user_id)
+            bot_profile = profiles.get(self.bot_user_id)
             if bot_profile and bot_profile.get('last_active_channel_id'):
                 priority_channel_ids.add(bot_profile['last_active_channel_id'])
         return priority_channel_ids
 
     async def store_message_for_context(self, message: discord.Message, existing_interaction_id: str = None):
         dev_logger.debug(f"Storing message ID {message.id} for context.")
+        role, interaction_id, content_to_store = await self._prepare_message_for_storage(message, existing_interaction_id)
+        await self._store_message_in_neo4j(message, role, interaction_id, content_to_store)
+        dev_logger.info(f"Successfully stored message ID {message.id} from '{message.author.name}'.")
+
+    async def store_messages_batch(self, messages: list[discord.Message]):
+        """
+        Stores several inbound messages for context. Users, interactions and attachment summaries
+        are prepared per message (concurrently), then every Message node is written in one batch.
+        """
+        if not messages: return
+        dev_logger.debug(f"Storing {len(messages)} message(s) for context in one batch.")
+        prepared = await asyncio.gather(*(self._prepare_message_for_storage(message) for message in messages), return_exceptions=True)
+        rows = []
+        for message, result in zip(messages, prepared):
+            if isinstance(result, BaseException):
+                dev_logger.error(f"Failed to prepare message ID {message.id} for storage: {result}", exc_info=result)
+                continue
+            role, interaction_id, content_to_store = result
+            rows.append(self._message_node_row(message, role, interaction_id, content_to_store))
+        if not rows or not self.neo4j_manager: return
+        try:
+            stored = await self.neo4j_manager.create_message_nodes_batch(rows)
+            dev_logger.info(f"Successfully stored {len(stored)}/{len(messages)} message(s) for context.")
+        except Exception as e:
+            dev_logger.error(f"Failed to store batch of {len(rows)} messages in Neo4j: {e}", exc_info=True)
+
+    async def _prepare_message_for_storage(self, message: discord.Message, existing_interaction_id: str = None) -> tuple[str, str, str]:
+        """Ensures the author and interaction exist; returns (role, interaction_id, content_to_store)."""
         user_id_str, username_str = str(message.author.id), message.author.name
         self.user_profile_manager.add_new_user(user_id=user_id_str, username=username_str)
-        interaction_timestamp = int(message.created_at.replace(tzinfo=dt_timezone.utc).timestamp())
+        if isinstance(message.channel, discord.DMChannel) and user_id_str != self.bot_user_id:
+            # Messages don't store is_dm; reads derive it from the user's dm_channel_id
+            self.user_profile_manager.update_user_dm_channel(user_id_str, message.channel.id)
+        interaction_timestamp = int(message.created_at.timestamp())
         interaction_id = existing_interaction_id or str(message.id)
         if not existing_interaction_id:
             await self.neo4j_manager.create_interaction(user_id_str, interaction_id, interaction_timestamp)
 
-        role = "assistant" if str(message.author.id) == self.bot_user_id else "user"
+        role = "assistant" if user_id_str == self.bot_user_id else "user"
         content_to_store = message.content
         if role == "user":
             content_to_store = await self._handle_attachments(message, message.content, interaction_id, interaction_timestamp)
+        return role, interaction_id, content_to_store
 
-        await self._store_message_in_neo4j(message, role, interaction_id, content_to_store)
-        dev_logger.info(f"Successfully stored message ID {message.id} from '{username_str}'.")
-
-    def _format_message_queue_for_prompt(self, current_channel_id: str) -> str:
+    def _format_message_queue_for_prompt(self, current_channel_id: str, alias_cache: dict[str, str] = None) -> str:
         """
         New: Peeks at the message queue and formats it for the LLM prompt.
         Filters to show only messages from the current channel.
+        alias_cache is an optional per-interaction {user_id: display alias} map reused across calls.
         """
+        if alias_cache is None:
+            alias_cache = {}
         MAX_QUEUE_DISPLAY = 3
         
-        # Access the underlying deque to peek without removing items
-        queued_messages = list(self.message_queue._queue)
-        
-        if not queued_messages:
-            return ""
-
-        # Filter messages for the current channel
-        relevant_messages = [msg for msg in queued_messages if str(msg.channel.id) == current_channel_id]
+        # Peek at this channel's bucket only, without copying it or removing items
+        relevant_messages = self.message_queue.messages_in_channel(current_channel_id)
         if not relevant_messages:
             return ""
+        displayed_messages = list(itertools.islice(relevant_messages, MAX_QUEUE_DISPLAY))
 
         formatted_queue = ["[MESSAGES AWAITING YOUR ATTENTION IN THIS CHANNEL]:"]
         
-        for msg in relevant_messages[:MAX_QUEUE_DISPLAY]:
-            author_alias = self.user_profile_manager.get_user_alias(str(msg.author.id)) or msg.author.display_name
+        for msg in displayed_messages:
+            author_id = str(msg.author.id)
+            author_alias = alias_cache.get(author_id)
+            if author_alias is None:
+                author_alias = alias_cache[author_id] = self.user_profile_manager.get_user_alias(author_id) or msg.author.display_name
             timestamp_str = msg.created_at.astimezone(self.timezone).isoformat()
             formatted_queue.append(f"- {author_alias}: {msg.content} [{timestamp_str}]")
 
-        if len(relevant_messages) > MAX_QUEUE_DISPLAY:
-            formatted_queue.append(f"- ...and {len(relevant_messages) - MAX_QUEUE_DISPLAY} more message(s) waiting.")
+        remaining_count = len(relevant_messages) - len(displayed_messages)
+        if remaining_count:
+            formatted_queue.append(f"- ...and {remaining_count} more message(s) waiting.")
         
         return "\n".join(formatted_queue)
 
@@ -261,7 +344,7 @@ class ConversationManager:
         dev_logger.info(f"Response triggered for message ID {message.id}. TinyGen processing paused.")
 
         interaction_id = str(message.id)
-        interaction_timestamp = int(message.created_at.replace(tzinfo=dt_timezone.utc).timestamp())
+        interaction_timestamp = int(message.created_at.timestamp())
 
         if await self._handle_alias_change(message, user_id_str, username_str, author_display_name, interaction_id, interaction_timestamp):
             await self.tinygen_controller.resume()
@@ -277,17 +360,25 @@ class ConversationManager:
         user_message_content = self.thought_processor.replace_mentions_with_aliases(message.content, self.user_profile_manager)
         user_message = {"role": "user", "content": f"{author_display_name}: {user_message_content}"}
         final_response_package = None
+        previous_tool_name = None
+
+        # None of these inputs change across tool iterations, so build them once.
+        channel_id_str = str(message.channel.id)
+        message_details_for_tp = (
+            f"This message is from {author_display_name} in {'DM' if is_dm else 'a public channel'}. "
+            f"Your relationship with {author_display_name} is: {self.user_profile_manager.get_gen_relationship(user_id_str)}. "
+        )
+        alias_cache: dict[str, str] = {user_id_str: author_display_name}
+        message_queue_str = self._format_message_queue_for_prompt(channel_id_str, alias_cache)
+        queue_version = len(self.message_queue.messages_in_channel(channel_id_str))
 
         for i in range(self.MAX_TOOL_ITERATIONS):
             dev_logger.info(f"Tool loop iteration {i+1}/{self.MAX_TOOL_ITERATIONS} for interaction: {interaction_id}")
 
-            # MODIFICATION: Generate the real-time queue display on each loop
-            message_queue_str = self._format_message_queue_for_prompt(str(message.channel.id))
-            
-            message_details_for_tp = (
-                f"This message is from {author_display_name} in {'DM' if is_dm else 'a public channel'}. "
-                f"Your relationship with {author_display_name} is: {self.user_profile_manager.get_gen_relationship(user_id_str)}. "
-            )
+            # Only re-render the real-time queue display when the queue actually changed
+            if len(self.message_queue.messages_in_channel(channel_id_str)) != queue_version:
+                message_queue_str = self._format_message_queue_for_prompt(channel_id_str, alias_cache)
+                queue_version = len(self.message_queue.messages_in_channel(channel_id_str))
 
             # NOTE: get_next_decision in thought_processor.py must be updated to accept 'message_queue_str'
             llm_decision = await self.thought_processor.get_next_decision(
@@ -297,11 +388,14 @@ class ConversationManager:
                 long_term_history_str=long_term_history_str,
                 message_queue_str=message_queue_str, # Pass the new queue block
                 persona_data={'details_for_prompt': message_details_for_tp},
-                max_tokens=self.llm_max_output_tokens
+                max_tokens=self.llm_max_output_tokens,
+                tools=capabilities.get_active_tool_schemas(previous_tool_name)
             )
 
             if llm_decision.get("type") == "tool_call":
                 tool_name, tool_args, tool_call_id = llm_decision["name"], llm_decision["arguments"], llm_decision["id"]
+                previous_tool_name = tool_name
+                tool_args_json = orjson.dumps(tool_args).decode()
 
                 tool_execution_result = await self.thought_processor.execute_tool(tool_name, tool_args, tool_call_id, {}, user_id_str, author_display_name)
                 
@@ -312,17 +406,17 @@ class ConversationManager:
                 if tool_name != "respond_to_user":
                     await self.neo4j_manager.insert_action(
                         interaction_id=interaction_id,
-                        channel_id=str(message.channel.id),
+                        channel_id=channel_id_str,
                         action_type=tool_name,
-                        timestamp=int(datetime.now(dt_timezone.utc).timestamp()),
-                        reason=f"LLM tool call: {tool_name}, args: {json.dumps(tool_args)}",
+                        timestamp=int(time.time()),
+                        reason=f"LLM tool call: {tool_name}, args: {tool_args_json}",
                         result_summary=summary_for_action_node[:1000],
                         tool_call_id=tool_call_id
                     )
 
                 assistant_turn = {
                     "role": "assistant", "content": None,
-                    "tool_calls": [{"id": tool_call_id, "type": "function", "function": {"name": tool_name, "arguments": json.dumps(tool_args)}}]
+                    "tool_calls": [{"id": tool_call_id, "type": "function", "function": {"name": tool_name, "arguments": tool_args_json}}]
                 }
                 tool_result_turn = {
                     "role": "tool", "tool_call_id": tool_call_id, "name": tool_name,
@@ -2,20 +2,85 @@
 
 import os
 import logging
+import time
 import asyncio
+from collections import OrderedDict
+import numpy as np
 from pymilvus import connections, Collection, CollectionSchema, FieldSchema, DataType, utility
 from embeddings import generate_embedding
 
+INSERT_BATCH_MAX_SIZE = 128
+INSERT_FLUSH_DELAY_SECONDS = 0.05
+
 thought_logger = logging.getLogger('thought')
 dev_logger = logging.getLogger('dev')
 
+class QueryCache:
+    """
+    Small LRU of search results with a per-entry TTL.
+    Only touched from the event loop, so it needs no locking.
+    """
+    def __init__(self, max_size=2000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, results = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return results
+
+    def put(self, key, results):
+        self._entries[key] = (time.monotonic() + self.ttl, results)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
 class DatabaseManager:
     def __init__(self):
         self.host = "milvus-standalone"
         self.port = "19530"
         self.collection_name = "Everything"
         self.dimension = 384  # Matches all-MiniLM-L6-v2
+        # Half-precision vectors halve the HNSW graph's memory; all-MiniLM output is
+        # L2-normalized, so inner product ranks the same as cosine similarity.
+        self.vector_dtype = DataType.FLOAT16_VECTOR
+        self.metric_type = "IP"
+        # HNSW (default) or IVF_SQ8, which stores the index as int8 codes with per-dimension
+        # ranges learned by Milvus at build time: a quarter of FP32, for a small recall loss
+        self.index_type = os.getenv('MILVUS_INDEX_TYPE', 'HNSW').upper()
+        if self.index_type not in ("HNSW", "IVF_SQ8"):
+            dev_logger.warning(f"Unsupported MILVUS_INDEX_TYPE '{self.index_type}', using HNSW.")
+            self.index_type = "HNSW"
+        # HNSW build and query parameters; ef at query time is independent of efConstruction
+        self.hnsw_m = int(os.getenv('HNSW_M', '16'))
+        self.hnsw_ef_construction = int(os.getenv('HNSW_EF_CONSTRUCTION', '64'))
+        self.hnsw_ef_search = int(os.getenv('HNSW_EF_SEARCH', '40'))
+        # IVF_SQ8 build and query parameters
+        self.ivf_nlist = int(os.getenv('IVF_NLIST', '128'))
+        self.ivf_nprobe = int(os.getenv('IVF_NPROBE', '16'))
+        if self.index_type == "HNSW":
+            dev_logger.info(f"Milvus HNSW settings: M={self.hnsw_m}, efConstruction={self.hnsw_ef_construction}, ef={self.hnsw_ef_search}")
+        else:
+            dev_logger.info(f"Milvus IVF_SQ8 settings: nlist={self.ivf_nlist}, nprobe={self.ivf_nprobe}")
         self.collection = None
+        self._loaded = False
+        self.search_cache = QueryCache(max_size=2000, ttl=300)
+        # Bumped on every insert so cached searches never miss newly stored rows
+        self._generation = 0
+        # Rows waiting for the next batched insert, as (row, future) in arrival order
+        self._pending = []
+        self._flush_task = None
+        self._inflight_inserts = set()
         self.connect()
         self._reset_mdb_if_needed()
         self.create_everything_collection()
@@ -31,7 +96,7 @@ class DatabaseManager:
             except Exception as e:
                 if attempt < retries - 1:
                     dev_logger.warning(f"Failed to connect to Milvus (attempt {attempt + 1}/{retries}): {e}")
-                    asyncio.run(asyncio.sleep(5))
+                    time.sleep(5)
                 else:
                     dev_logger.error(f"Failed to connect to Milvus after {retries} attempts: {e}")
                     raise
@@ -55,32 +120,68 @@ class DatabaseManager:
         if not utility.has_collection(self.collection_name):
             fields = [
                 FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True),
-                FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=self.dimension),
+                FieldSchema(name="embedding", dtype=self.vector_dtype, dim=self.dimension),
                 FieldSchema(name="metadata", dtype=DataType.JSON)
             ]
             schema = CollectionSchema(fields=fields, description="Universal collection for Gen's data")
             self.collection = Collection(self.collection_name, schema)
+            if self.index_type == "IVF_SQ8":
+                build_params = {"nlist": self.ivf_nlist}
+            else:
+                build_params = {"M": self.hnsw_m, "efConstruction": self.hnsw_ef_construction}
             index_params = {
-                "metric_type": "L2",
-                "index_type": "HNSW",
-                "params": {"M": 16, "efConstruction": 200}
+                "metric_type": self.metric_type,
+                "index_type": self.index_type,
+                "params": build_params
             }
             self.collection.create_index(field_name="embedding", index_params=index_params)
             self.collection.load()
+            self._loaded = True
             dev_logger.debug(f"Created Milvus collection: {self.collection_name}")
-            thought_logger.info(f"Successfully created Everything collection with HNSW index")
+            thought_logger.info(f"Successfully created Everything collection with {self.index_type} index")
         else:
             self.collection = Collection(self.collection_name)
+            self._adopt_existing_vector_format()
             self.collection.load()
+            self._loaded = True
             dev_logger.debug(f"Loaded existing Milvus collection: {self.collection_name}")
 
-    async def insert_everything(self, text_to_embed, metadata):
+    def _adopt_existing_vector_format(self):
+        """Match the vector type and metric of a collection created before the FP16/IP switch."""
+        try:
+            for field in self.collection.schema.fields:
+                if field.name == "embedding":
+                    self.vector_dtype = field.dtype
+            for index in self.collection.indexes:
+                if index.field_name == "embedding":
+                    self.metric_type = index.params.get("metric_type", self.metric_type)
+                    existing_index_type = index.params.get("index_type", self.index_type)
+                    if existing_index_type != self.index_type:
+                        dev_logger.warning(f"Everything collection has a {existing_index_type} index; set RESET_MDB=True to rebuild it as {self.index_type}.")
+                        self.index_type = existing_index_type
+        except Exception as e:
+            dev_logger.error(f"Failed to read Everything collection schema: {e}", exc_info=True)
+        if self.vector_dtype != DataType.FLOAT16_VECTOR or self.metric_type != "IP":
+            dev_logger.warning(f"Everything collection uses {self.vector_dtype.name}/{self.metric_type}; set RESET_MDB=True to rebuild it as FLOAT16_VECTOR/IP.")
+
+    def _to_vector(self, embedding):
+        """Convert an embedding to the representation the collection's vector field expects."""
+        if self.metric_type == "IP":
+            # IP only ranks like cosine on unit vectors; don't rely on the model to guarantee it
+            embedding = np.asarray(embedding, dtype=np.float32)
+            embedding = embedding / (np.linalg.norm(embedding) + 1e-12)
+        if self.vector_dtype == DataType.FLOAT16_VECTOR:
+            return np.asarray(embedding, dtype=np.float16)
+        return embedding.tolist()
+
+    async def insert_everything(self, text_to_embed, metadata, embedding=None):
         """
         Insert data into the Everything collection with embedding and JSON metadata.
 
         Args:
             text_to_embed (str): Text to generate the embedding.
             metadata (dict): JSON-compatible dictionary with metadata (e.g., type, title, description).
+            embedding (np.ndarray, optional): Precomputed embedding of text_to_embed; generated if omitted.
 
         Returns:
             int: Milvus ID of the inserted entry.
@@ -88,19 +189,64 @@ class DatabaseManager:
         if self.collection is None:
             self.create_everything_collection()
         
-        embedding = await generate_embedding(text_to_embed, use_secondary=True)
-        data = [{
-            "embedding": embedding.tolist(),
+        if embedding is None:
+            embedding = await generate_embedding(text_to_embed, use_secondary=True)
+        row = {
+            "embedding": self._to_vector(embedding),
             "metadata": metadata
-        }]
+        }
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((row, future))
+        if len(self._pending) >= INSERT_BATCH_MAX_SIZE:
+            task = asyncio.create_task(self._insert_batch(self._take_pending()))
+            self._inflight_inserts.add(task)
+            task.add_done_callback(self._inflight_inserts.discard)
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_after_delay())
+        milvus_id = await future
+        dev_logger.debug(f"Inserted data into Everything: metadata={metadata}, milvus_id={milvus_id}")
+        return milvus_id
+
+    def _take_pending(self):
+        """Detach the pending rows for a flush and cancel any debounce still waiting on them."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        batch, self._pending = self._pending, []
+        return batch
+
+    async def _flush_after_delay(self):
+        """Debounce: give concurrent inserts a moment to join the batch."""
+        await asyncio.sleep(INSERT_FLUSH_DELAY_SECONDS)
+        # Past this point the flush must not be cancelled, or its callers would never be resolved
+        self._flush_task = None
+        await self._insert_batch(self._take_pending())
+
+    async def _insert_batch(self, batch):
+        """Insert rows in one call and resolve each caller's future with its ID."""
+        if not batch:
+            return
         try:
-            result = self.collection.insert(data)
-            milvus_id = result.primary_keys[0]
-            dev_logger.debug(f"Inserted data into Everything: metadata={metadata}, milvus_id={milvus_id}")
-            return milvus_id
+            # pymilvus is synchronous; keep the event loop free while the RPC is in flight
+            result = await asyncio.to_thread(self.collection.insert, [row for row, _ in batch])
+            self._generation += 1
+            self.search_cache.clear()
+            for (_, future), milvus_id in zip(batch, result.primary_keys):
+                if not future.done():
+                    future.set_result(milvus_id)
+            dev_logger.debug(f"Flushed {len(batch)} row(s) into Everything")
         except Exception as e:
             dev_logger.error(f"Failed to insert data into Everything: {e}")
-            raise
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    def _search_params(self, limit):
+        """Query-time parameters for the collection's index type."""
+        if self.index_type == "IVF_SQ8":
+            return {"nprobe": self.ivf_nprobe}
+        # Milvus rejects ef below the requested top-k
+        return {"ef": max(self.hnsw_ef_search, limit)}
 
     async def search_everything(self, query, limit=5):
         """
@@ -115,17 +261,31 @@ class DatabaseManager:
         """
         if self.collection is None:
             self.create_everything_collection()
-        
+
+        cache_key = (query, limit, self._generation)
+        cached = self.search_cache.get(cache_key)
+        if cached is not None:
+            dev_logger.debug(f"Search cache hit for query '{query[:50]}...': {len(cached)} items")
+            return list(cached)
+
         try:
             embedding = await generate_embedding(query, use_secondary=True)
-            self.collection.load()
-            results = self.collection.search(
-                data=[embedding.tolist()],
-                anns_field="embedding",
-                param={"metric_type": "L2", "params": {"ef": 200}},
-                limit=limit,
-                output_fields=["id", "metadata"]
-            )
+            search_params = {
+                "data": [self._to_vector(embedding)],
+                "anns_field": "embedding",
+                "param": {"metric_type": self.metric_type, "params": self._search_params(limit)},
+                "limit": limit,
+                "output_fields": ["id", "metadata"]
+            }
+            try:
+                results = self.collection.search(**search_params)
+            except Exception as e:
+                # The collection is loaded at startup; only reload if Milvus has since released it
+                dev_logger.warning(f"Search on Everything failed, reloading collection and retrying once: {e}")
+                self._loaded = False
+                self.collection.load()
+                self._loaded = True
+                results = self.collection.search(**search_params)
             search_results = []
             for hits in results:
                 for hit in hits:
@@ -135,7 +295,10 @@ class DatabaseManager:
                         "metadata": hit.entity.get("metadata")
                     })
             dev_logger.debug(f"Search results for query '{query[:50]}...': {len(search_results)} items")
-            return search_results
+            # Skip caching if an insert landed while this search was in flight
+            if cache_key[2] == self._generation:
+                self.search_cache.put(cache_key, search_results)
+            return list(search_results)
         except Exception as e:
             dev_logger.error(f"Failed to search Everything: {e}")
             raise
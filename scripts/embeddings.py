@@ -8,51 +8,133 @@ import numpy as np
 
 dev_logger = logging.getLogger('dev')
 
-async def generate_embedding(text, use_secondary=True):
-    """
-    Generate an embedding for the given text using LocalAI.
+# Concurrent generate_embedding calls are coalesced into one /v1/embeddings request.
+EMBEDDING_BATCH_MAX_SIZE = 32
+EMBEDDING_BATCH_WINDOW_SECONDS = 0.01
+EMBEDDING_DIMENSION = 384  # all-MiniLM-L6-v2
 
-    Args:
-        text (str): The text to embed.
-        use_secondary (bool): Use LOCALAI_2_URL if True, else LOCALAI_URL.
+# Shared failure result; read-only so no caller can corrupt it for everyone else
+_ZERO_EMBEDDING = np.zeros(EMBEDDING_DIMENSION, dtype=np.float32)
+_ZERO_EMBEDDING.setflags(write=False)
 
-    Returns:
-        np.ndarray: A 384-dimensional embedding vector, or zeros on failure.
-    """
+_SESSION: aiohttp.ClientSession | None = None
+_embedding_queue: asyncio.Queue | None = None
+_embedding_worker: asyncio.Task | None = None
+_inflight_batches: set[asyncio.Task] = set()
+
+async def _get_session() -> aiohttp.ClientSession:
+    """Returns the shared keep-alive session, creating it on first use."""
+    global _SESSION
+    if _SESSION is None or _SESSION.closed:
+        _SESSION = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=100, limit_per_host=32, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=30)
+        )
+    return _SESSION
+
+async def close_session():
+    """Closes the shared session. Called on bot shutdown."""
+    global _SESSION
+    if _SESSION is not None and not _SESSION.closed:
+        await _SESSION.close()
+    _SESSION = None
+
+def _embedding_endpoint(use_secondary):
+    """Returns (url, headers, model) for the primary or secondary LocalAI instance."""
     base_url = os.getenv('LOCALAI_2_URL', os.getenv('LOCALAI_URL', 'http://10.0.1.101:9090')) if use_secondary else os.getenv('LOCALAI_URL', 'http://10.0.1.101:9090')
     url = f"{base_url}/v1/embeddings"
     api_key = os.getenv('LOCALAI_2_API_KEY', os.getenv('LOCALAI_API_KEY')) if use_secondary else os.getenv('LOCALAI_API_KEY')
     model = os.getenv('EMBEDDINGS_2_MODEL', os.getenv('EMBEDDINGS_MODEL', 'all-MiniLM-L6-v2')) if use_secondary else os.getenv('EMBEDDINGS_MODEL', 'all-MiniLM-L6-v2')
-    dev_logger.debug(f"Generating embedding for text: '{text[:50]}...' using URL: {url}, model: {model}")
-    
     headers = {"Content-Type": "application/json"}
     if api_key:
         headers["Authorization"] = f"Bearer {api_key}"
-    payload = {"model": model, "input": text if text.strip() else "default"}
+    return url, headers, model
+
+async def _request_embeddings(texts, use_secondary=True):
+    """
+    Embed a batch of texts in a single request, with retries and secondary -> primary fallback.
+
+    Returns:
+        list[np.ndarray]: One 384-dimensional float32 vector per text, or the shared read-only zero vector for all on failure.
+    """
+    url, headers, model = _embedding_endpoint(use_secondary)
+    dev_logger.debug(f"Generating {len(texts)} embedding(s), first text: '{texts[0][:50]}...' using URL: {url}, model: {model}")
+    payload = {"model": model, "input": [text if text.strip() else "default" for text in texts]}
     retries = 3
-    
-    async with aiohttp.ClientSession() as session:
-        for attempt in range(retries):
+
+    session = await _get_session()
+    for attempt in range(retries):
+        try:
+            async with asyncio.timeout(30):
+                async with session.post(url, json=payload, headers=headers) as resp:
+                    if resp.status == 200:
+                        data = await resp.json()
+                        if "data" not in data or len(data["data"]) != len(texts):
+                            dev_logger.error(f"Unexpected 'data' in embedding response: {data}")
+                            raise ValueError("Embedding response does not match the batch size")
+                        items = sorted(data["data"], key=lambda item: item.get("index", 0))
+                        embeddings = [np.fromiter(item["embedding"], dtype=np.float32, count=len(item["embedding"])) for item in items]
+                        dev_logger.debug(f"Generated {len(embeddings)} embedding(s) with shape: {embeddings[0].shape}")
+                        return embeddings
+                    dev_logger.error(f"Embedding generation failed (attempt {attempt + 1}/{retries}): {resp.status} - {await resp.text()}")
+        except asyncio.TimeoutError:
+            dev_logger.error(f"Embedding generation timed out (attempt {attempt + 1}/{retries})")
+        except Exception as e:
+            dev_logger.error(f"Embedding generation error (attempt {attempt + 1}/{retries}): {e}")
+        if attempt < retries - 1:
+            await asyncio.sleep(1)
+        if use_secondary and attempt == retries - 1:
+            dev_logger.warning("Secondary LocalAI failed, falling back to primary LocalAI")
+            return await _request_embeddings(texts, use_secondary=False)
+    dev_logger.error("Failed to generate embedding after all retries")
+    return [_ZERO_EMBEDDING] * len(texts)
+
+async def _embed_batch(batch, use_secondary):
+    """Runs one batched request and resolves each caller's future."""
+    try:
+        embeddings = await _request_embeddings([text for text, _, _ in batch], use_secondary=use_secondary)
+        for (_, _, future), embedding in zip(batch, embeddings):
+            if not future.done():
+                future.set_result(embedding)
+    except Exception as e:
+        for _, _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+
+async def _embedding_batch_worker():
+    """Collects queued requests for a short window and dispatches them as batches."""
+    while True:
+        batch = [await _embedding_queue.get()]
+        await asyncio.sleep(EMBEDDING_BATCH_WINDOW_SECONDS)
+        while len(batch) < EMBEDDING_BATCH_MAX_SIZE:
             try:
-                async with asyncio.timeout(30):
-                    async with session.post(url, json=payload, headers=headers) as resp:
-                        if resp.status == 200:
-                            data = await resp.json()
-                            if "data" not in data or not data["data"]:
-                                dev_logger.error(f"No 'data' in embedding response: {data}")
-                                raise ValueError("No 'data' in embedding response")
-                            embedding = np.array(data["data"][0]["embedding"])
-                            dev_logger.debug(f"Generated embedding with shape: {embedding.shape}")
-                            return embedding
-                        dev_logger.error(f"Embedding generation failed (attempt {attempt + 1}/{retries}): {resp.status} - {await resp.text()}")
-            except asyncio.TimeoutError:
-                dev_logger.error(f"Embedding generation timed out (attempt {attempt + 1}/{retries})")
-            except Exception as e:
-                dev_logger.error(f"Embedding generation error (attempt {attempt + 1}/{retries}): {e}")
-            if attempt < retries - 1:
-                await asyncio.sleep(1)
-            if use_secondary and attempt == retries - 1:
-                dev_logger.warning("Secondary LocalAI failed, falling back to primary LocalAI")
-                return await generate_embedding(text, use_secondary=False)
-        dev_logger.error("Failed to generate embedding after all retries")
-        return np.zeros(384)
+                batch.append(_embedding_queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        # Requests for different endpoints cannot share a batch
+        for use_secondary in (True, False):
+            group = [item for item in batch if item[1] == use_secondary]
+            if group:
+                task = asyncio.create_task(_embed_batch(group, use_secondary))
+                _inflight_batches.add(task)
+                task.add_done_callback(_inflight_batches.discard)
+
+async def generate_embedding(text, use_secondary=True):
+    """
+    Generate an embedding for the given text using LocalAI.
+    Concurrent calls are coalesced into batched requests by a background worker.
+
+    Args:
+        text (str): The text to embed.
+        use_secondary (bool): Use LOCALAI_2_URL if True, else LOCALAI_URL.
+
+    Returns:
+        np.ndarray: A 384-dimensional float32 embedding vector, or a read-only zero vector on failure.
+    """
+    global _embedding_queue, _embedding_worker
+    if _embedding_worker is None or _embedding_worker.done():
+        _embedding_queue = asyncio.Queue()
+        _embedding_worker = asyncio.create_task(_embedding_batch_worker())
+    future = asyncio.get_running_loop().create_future()
+    _embedding_queue.put_nowait((text, use_secondary, future))
+    return await future
@@ -1,16 +1,36 @@
 # history_manager.py
 
 import os
+import time
 import logging
-from datetime import datetime, timedelta, timezone as dt_timezone
+import functools
+import heapq
+from datetime import datetime
 import pytz
-import asyncio
 import discord
+from message_queue import ChannelPartitionedQueue
+from thought_processor import MENTION_RE
 
 dev_logger = logging.getLogger('dev')
 
+# Offsets are resolved per quarter hour: every real-world DST transition (including the
+# half-hour zones such as St. John's and Lord Howe) lands on a 15-minute UTC boundary.
+TZ_OFFSET_BUCKET_SECONDS = 900
+
+# Conservative characters-per-token ratio for the pre-format budget check. Real text averages
+# about 4 characters per token, so a turn this estimate rejects would not have fit anyway.
+HISTORY_PRECHECK_CHARS_PER_TOKEN = 8
+
+@functools.lru_cache(maxsize=1024)
+def _utc_offset_for_bucket(tz, bucket: int) -> tuple[int, str]:
+    """Returns (offset_seconds, '+HH:MM' suffix) for `tz` during the given quarter-hour bucket."""
+    offset = int(datetime.fromtimestamp(bucket * TZ_OFFSET_BUCKET_SECONDS, tz).utcoffset().total_seconds())
+    sign = '-' if offset < 0 else '+'
+    hours, minutes = divmod(abs(offset) // 60, 60)
+    return offset, f"{sign}{hours:02d}:{minutes:02d}"
+
 class HistoryManager:
-    def __init__(self, neo4j_manager, user_profile_manager, thought_processor, tokenizer=None, channel_name_map={},
+    def __init__(self, neo4j_manager, user_profile_manager, thought_processor, tokenizer_provider=None, channel_name_map={},
                  timezone=pytz.timezone(os.getenv('TIMEZONE', 'UTC')),
                  history_primary_timeframe_hours=24, history_primary_fetch_limit=150,
                  history_supplementary_timeframe_hours=6, history_supplementary_fetch_limit=50,
@@ -19,7 +39,7 @@ class HistoryManager:
         self.neo4j_manager = neo4j_manager
         self.user_profile_manager = user_profile_manager
         self.thought_processor = thought_processor  # For replace_mentions_with_aliases
-        self.tokenizer = tokenizer
+        self.tokenizer_provider = tokenizer_provider
         self.channel_name_map = channel_name_map
         self.timezone = timezone
         self.history_primary_timeframe_hours = history_primary_timeframe_hours
@@ -32,7 +52,11 @@ class HistoryManager:
         self.bot_user_id = bot_user_id
         dev_logger.debug("HistoryManager initialized with dynamic settings.")
 
-    async def build_llm_history(self, current_message: discord.Message, dynamic_history_token_budget: int, message_queue: asyncio.Queue, current_interaction_id: str) -> tuple[list, str]:
+    @property
+    def tokenizer(self):
+        return self.tokenizer_provider.tokenizer if self.tokenizer_provider else None
+
+    async def build_llm_history(self, current_message: discord.Message, dynamic_history_token_budget: int, message_queue: ChannelPartitionedQueue, current_interaction_id: str) -> tuple[list, str]:
         """
         Builds the LLM conversation history by fetching messages and actions from Neo4j.
         Prioritizes channels, supplements if needed, formats content with aliases/channels/timestamps,
@@ -47,114 +71,134 @@ class HistoryManager:
         all_raw_messages_dict = {}
         all_raw_actions_dict = {}  # For action summaries
 
-        now_utc = datetime.now(dt_timezone.utc)
-        priority_oldest_ts_cutoff = int((now_utc - timedelta(hours=self.history_primary_timeframe_hours)).timestamp())
-
-        # Fetch priority messages
-        if priority_channel_ids:
-            messages = self.neo4j_manager.get_messages_from_channels(
-                channel_ids=list(priority_channel_ids),
-                oldest_timestamp_cutoff=priority_oldest_ts_cutoff,
-                limit=self.history_primary_fetch_limit
-            )
-            for msg in messages:
-                all_raw_messages_dict[msg['message_id']] = msg
+        now_ts = int(time.time())
+        priority_oldest_ts_cutoff = now_ts - self.history_primary_timeframe_hours * 3600
 
-        current_raw_token_sum = sum(msg.get('token_count', self._estimate_token_count(msg.get('content_stored', '')) + 5) for msg in all_raw_messages_dict.values())
+        supplementary_channel_ids = set(self.channel_name_map.keys()) - priority_channel_ids
+        supplementary_oldest_ts_cutoff = now_ts - self.history_supplementary_timeframe_hours * 3600
 
+        # One round trip for priority messages, supplementary messages and actions.
+        # Priority messages come back without a time cutoff; the newest-first LIMIT makes the
+        # in-window ones a prefix of that list, so the expanded timeframe needs no second query.
+        bundle = self.neo4j_manager.get_history_bundle(
+            priority_channel_ids=list(priority_channel_ids),
+            supplementary_channel_ids=list(supplementary_channel_ids),
+            supplementary_oldest_timestamp_cutoff=supplementary_oldest_ts_cutoff,
+            actions_oldest_timestamp_cutoff=priority_oldest_ts_cutoff,
+            priority_limit=self.history_primary_fetch_limit,
+            supplementary_limit=self.history_supplementary_fetch_limit
+        )
+
+        # Priority messages within the primary timeframe
+        priority_messages = bundle['priority']
+        messages = [msg for msg in priority_messages if (msg['timestamp'] or 0) >= priority_oldest_ts_cutoff]
         # Expand timeframe if few messages
-        if len(all_raw_messages_dict) < self.history_fresh_db_msg_count_threshold and priority_channel_ids:
-            messages = self.neo4j_manager.get_messages_from_channels(
-                channel_ids=list(priority_channel_ids),
-                oldest_timestamp_cutoff=None,
-                limit=self.history_primary_fetch_limit
-            )
-            for msg in messages:
-                if msg['message_id'] not in all_raw_messages_dict:
-                    all_raw_messages_dict[msg['message_id']] = msg
-            current_raw_token_sum = sum(msg.get('token_count', self._estimate_token_count(msg.get('content_stored', '')) + 5) for msg in all_raw_messages_dict.values())
+        if len(messages) < self.history_fresh_db_msg_count_threshold:
+            messages = priority_messages
+        self._fill_missing_token_counts(messages)
+        # Raw token total of all_raw_messages_dict, kept up to date as messages are added
+        current_raw_token_sum = 0
+        for msg in messages:
+            if msg['message_id'] not in all_raw_messages_dict:
+                all_raw_messages_dict[msg['message_id']] = msg
+                current_raw_token_sum += msg['token_count']
 
         # Supplement from other channels if tokens low
+        supplementary_messages = []
         if current_raw_token_sum < (dynamic_history_token_budget * self.history_low_token_threshold_percent):
-            supplementary_channel_ids = set(self.channel_name_map.keys()) - priority_channel_ids
-            if supplementary_channel_ids:
-                supplementary_oldest_ts_cutoff = int((now_utc - timedelta(hours=self.history_supplementary_timeframe_hours)).timestamp())
-                messages = self.neo4j_manager.get_messages_from_channels(
-                    channel_ids=list(supplementary_channel_ids),
-                    oldest_timestamp_cutoff=supplementary_oldest_ts_cutoff,
-                    limit=self.history_supplementary_fetch_limit
-                )
-                for msg in messages:
-                    if msg['message_id'] not in all_raw_messages_dict:
-                        all_raw_messages_dict[msg['message_id']] = msg
-
-        # Fetch actions
-        actions = self._fetch_actions(priority_oldest_ts_cutoff)
-        for action in actions:
+            for msg in bundle['supplementary']:
+                if msg['message_id'] not in all_raw_messages_dict:
+                    all_raw_messages_dict[msg['message_id']] = msg
+                    supplementary_messages.append(msg)
+
+        for action in bundle['actions']:
             all_raw_actions_dict[action['action_id']] = action
 
         if not all_raw_messages_dict and not all_raw_actions_dict:
             return [], ""
 
-        # Combine and sort by timestamp
-        combined_items = []
-        for msg in all_raw_messages_dict.values():
-            combined_items.append({'type': 'message', 'timestamp': msg['timestamp'], 'data': msg, 'id': msg['message_id']})
-        for action in all_raw_actions_dict.values():
-            combined_items.append({'type': 'action', 'timestamp': action['timestamp'], 'data': action, 'id': action['action_id']})
-        sorted_combined = sorted(combined_items, key=lambda x: x['timestamp'])
+        # Every list above is already newest first from Neo4j, so a k-way merge yields the
+        # combined newest-first stream lazily; the loop below stops consuming once the budget is full.
+        newest_first_items = heapq.merge(
+            (('message', msg['timestamp'] or 0, msg, msg['message_id']) for msg in messages),
+            (('message', msg['timestamp'] or 0, msg, msg['message_id']) for msg in supplementary_messages),
+            (('action', action['timestamp'] or 0, action, action['action_id']) for action in bundle['actions']),
+            key=lambda item: item[1], reverse=True
+        )
 
         # Get IDs from queue and current interaction for deduplication
-        queue_ids = {str(msg.id) for msg in list(message_queue._queue)}
-        current_interaction_ids = {current_interaction_id}
+        queue_ids = message_queue.ids  # Live view maintained by the queue; read-only here
 
         # Build history turns with deduplication
         final_history_turns = []
         current_llm_tokens = 0
         temp_selected_turns_reversed = []
-        used_ids = set(queue_ids) | current_interaction_ids  # Start with queue and current to dedup against them
+        used_ids = {current_interaction_id}  # Start with current to dedup against it
+
+        # Resolve every speaker's and every mentioned user's alias in one round trip
+        # instead of one lookup per message and per mention
+        interacting_user_id = str(current_message.author.id)
+        user_ids = {interacting_user_id}
+        for m in all_raw_messages_dict.values():
+            if m.get('author_user_id'):
+                user_ids.add(m['author_user_id'])
+            content = m.get('content_stored')
+            if content and '<@' in content:
+                user_ids.update(MENTION_RE.findall(content))
+        alias_cache = self.user_profile_manager.get_aliases_bulk(user_ids)
+        interacting_user_alias = alias_cache.get(interacting_user_id) or "User"
+        iso_timestamp_cache = {}
 
-        interacting_user_alias = self.user_profile_manager.get_user_alias(str(current_message.author.id)) or "User"
+        # Hot-loop lookups bound to locals
+        channel_name_map = self.channel_name_map
+        replace_mentions = self.thought_processor.replace_mentions_with_aliases_cached
+        get_iso_timestamp = self._get_iso_timestamp
+        estimate_token_count = self._estimate_token_count
+        budget = dynamic_history_token_budget
+        precheck_chars_per_token = HISTORY_PRECHECK_CHARS_PER_TOKEN
+        append_turn = temp_selected_turns_reversed.append
 
-        for item in reversed(sorted_combined):
-            item_id = item['id']
-            if item_id in used_ids:
+        for item_type, _, item_data, item_id in newest_first_items:
+            if item_id in used_ids or item_id in queue_ids:
                 continue  # Skip if already in queue or current
+            if item_type == 'action' and item_data['action_type'] == 'respond_to_user':
+                continue
+
+            # Cheap lower bound on the turn's size before paying for any formatting
+            raw_text = item_data.get('content_stored') if item_type == 'message' else item_data.get('result_summary')
+            if raw_text and current_llm_tokens + len(raw_text) // precheck_chars_per_token + 5 > budget:
+                break
 
-            if item['type'] == 'message':
-                raw_msg = item['data']
-                content_with_aliases = self.thought_processor.replace_mentions_with_aliases(
-                    raw_msg['content_stored'], self.user_profile_manager
-                )
+            if item_type == 'message':
+                raw_msg = item_data
+                content_with_aliases = replace_mentions(raw_msg['content_stored'] or '', alias_cache)
                 speaker_alias = "Unknown Speaker"
                 author_id = raw_msg.get('author_user_id')
                 if raw_msg['role'] == 'user' and author_id:
-                    speaker_alias = self.user_profile_manager.get_user_alias(author_id) or f"User ({author_id[-4:]})"
+                    speaker_alias = alias_cache.get(author_id) or f"User ({author_id[-4:]})"
                 elif raw_msg['role'] == 'assistant':
                     speaker_alias = "Gen"
                 channel_display_name = "Unknown Channel"
                 channel_id = raw_msg.get('channel_id')
                 if raw_msg.get('is_dm'):
                     channel_display_name = f"DM-{interacting_user_alias}"
-                elif channel_id and channel_id in self.channel_name_map:
-                    channel_display_name = f"#{self.channel_name_map[channel_id]}"
+                elif channel_id and channel_id in channel_name_map:
+                    channel_display_name = f"#{channel_name_map[channel_id]}"
                 else:
                     channel_display_name = f"#{channel_id}"
-                iso_timestamp = self._get_iso_timestamp(raw_msg['timestamp'])
+                iso_timestamp = get_iso_timestamp(raw_msg['timestamp'], iso_timestamp_cache)
                 final_content = f"{speaker_alias}: {content_with_aliases} [Channel: {channel_display_name}, Timestamp: {iso_timestamp}]"
                 turn_role = raw_msg['role']
             else:
-                raw_action = item['data']
-                if raw_action['action_type'] == 'respond_to_user':
-                    continue
+                raw_action = item_data
                 summary = f"Action: {raw_action['action_type']} (Reason: {raw_action.get('reason', 'N/A')}, Result: {raw_action.get('result_summary', 'N/A')})"
-                iso_timestamp = self._get_iso_timestamp(raw_action['timestamp'])
+                iso_timestamp = get_iso_timestamp(raw_action['timestamp'], iso_timestamp_cache)
                 final_content = f"System Note: {summary} [Timestamp: {iso_timestamp}]"
                 turn_role = 'system'
 
-            turn_token_count = self._estimate_token_count(final_content) + 5
-            if current_llm_tokens + turn_token_count <= dynamic_history_token_budget:
-                temp_selected_turns_reversed.append({"role": turn_role, "content": final_content})
+            turn_token_count = estimate_token_count(final_content) + 5
+            if current_llm_tokens + turn_token_count <= budget:
+                append_turn({"role": turn_role, "content": final_content})
                 current_llm_tokens += turn_token_count
                 used_ids.add(item_id)
             else:
@@ -167,38 +211,55 @@ class HistoryManager:
 
         return final_stm_turns, long_term_history_str
 
-    def _get_iso_timestamp(self, timestamp: int):
-        """Convert Unix timestamp to ISO format with timezone."""
-        return datetime.fromtimestamp(timestamp, dt_timezone.utc).astimezone(self.timezone).isoformat()
+    def _get_iso_timestamp(self, timestamp: int, cache: dict = None):
+        """Convert Unix timestamp to ISO format with timezone, memoized in `cache` when given."""
+        if cache is not None:
+            iso = cache.get(timestamp)
+            if iso is None:
+                iso = cache[timestamp] = self._format_iso_timestamp(timestamp)
+            return iso
+        return self._format_iso_timestamp(timestamp)
+
+    def _format_iso_timestamp(self, timestamp: int) -> str:
+        """Same output as datetime.isoformat() in self.timezone, without building a datetime per row."""
+        timestamp = int(timestamp)
+        offset, suffix = _utc_offset_for_bucket(self.timezone, timestamp // TZ_OFFSET_BUCKET_SECONDS)
+        return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(timestamp + offset)) + suffix
 
     def _estimate_token_count(self, text: str) -> int:
-        """Estimate token count using tokenizer or fallback."""
-        if self.tokenizer:
-            return len(self.tokenizer.encode(text))
+        """Estimate token count using tokenizer or fallback. History turns repeat across builds, so counts are cached."""
+        if self.tokenizer_provider:
+            return self.tokenizer_provider.count_tokens(text)
         return len(text) // 4  # Fallback approximation
 
-    def _fetch_actions(self, oldest_timestamp_cutoff: int = None) -> list[dict]:
-        """Fetch actions from Neo4j, filtered by timestamp if provided."""
-        try:
-            with self.neo4j_manager.driver.session() as session:
-                query = "MATCH (a:Action)"
-                if oldest_timestamp_cutoff is not None:
-                    query += " WHERE a.timestamp >= $oldest_timestamp_cutoff"
-                query += " RETURN a.action_id AS action_id, a.action_type AS action_type, a.timestamp AS timestamp, a.reason AS reason, a.result_summary AS result_summary"
-                result = session.run(query, oldest_timestamp_cutoff=oldest_timestamp_cutoff)
-                return [dict(record) for record in result]
-        except Exception as e:
-            dev_logger.error(f"Failed to fetch actions from Neo4j: {e}", exc_info=True)
+    def _estimate_token_counts(self, texts: list[str]) -> list[int]:
+        """Estimate token counts for many texts with a single batched tokenizer call."""
+        if not texts:
             return []
+        if self.tokenizer:
+            return [len(ids) for ids in self.tokenizer.encode(texts)]
+        return [len(text) // 4 for text in texts]
+
+    def _fill_missing_token_counts(self, messages: list[dict]):
+        """Fill in 'token_count' for fetched messages that were stored without one, in one batch."""
+        missing = [msg for msg in messages if msg.get('token_count') is None]
+        if not missing:
+            return
+        counts = self._estimate_token_counts([msg.get('content_stored') or '' for msg in missing])
+        for msg, count in zip(missing, counts):
+            msg['token_count'] = count + 5
 
     def _get_channel_ids_for_priority_fetch(self, current_message: discord.Message) -> set[str]:
         priority_channel_ids = {str(current_message.channel.id)}
-        user_profile = self.neo4j_manager.get_user(str(current_message.author.id))
+        author_id = str(current_message.author.id)
+        # Author and bot profiles are fetched together in a single round trip
+        profiles = self.neo4j_manager.get_users([author_id, self.bot_user_id] if self.bot_user_id else [author_id])
+        user_profile = profiles.get(author_id)
         if user_profile:
             if user_profile.get('dm_channel_id'): priority_channel_ids.add(user_profile['dm_channel_id'])
             if user_profile.get('last_active_channel_id'): priority_channel_ids.add(user_profile['last_active_channel_id'])
         if self.bot_user_id:
-            bot_profile = self.neo4j_manager.get_user(self.bot_user_id)
+            bot_profile = profiles.get(self.bot_user_id)
             if bot_profile and bot_profile.get('last_active_channel_id'):
                 priority_channel_ids.add(bot_profile['last_active_channel_id'])
         return priority_channel_ids
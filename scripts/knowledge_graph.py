@@ -1,8 +1,15 @@
 # knowledge_graph.py
 
 import os
+import time
+import random
 import logging
-from neo4j import GraphDatabase
+import asyncio
+import hashlib
+import functools
+from collections import OrderedDict
+from collections.abc import Iterator
+from neo4j import GraphDatabase, AsyncGraphDatabase, RoutingControl, READ_ACCESS
 from datetime import datetime
 import pytz
 from embeddings import generate_embedding
@@ -11,34 +18,285 @@ from database_manager import DatabaseManager
 dev_logger = logging.getLogger('dev')
 neo4j_logger = logging.getLogger('neo4j')
 
+# Message writes are funnelled through one worker that upserts whatever has queued up
+# while the previous batch was in flight; the bounded queue applies backpressure.
+MESSAGE_WRITE_QUEUE_SIZE = 64
+MESSAGE_WRITE_BATCH_MAX_SIZE = 64
+
+# connect() backs off exponentially (0.5s doubling, capped) so a restarting Neo4j is
+# retried quickly at first and ~60s of outage is covered overall
+CONNECT_RETRIES = 8
+CONNECT_BACKOFF_BASE_SECONDS = 0.5
+CONNECT_BACKOFF_MAX_SECONDS = 30
+
+# Last-written per-user values, so repeat updates from message events skip Neo4j entirely
+USER_WRITE_CACHE_MAX_SIZE = 10_000
+
+# Aliases change rarely; the all-users mention mapping is re-read at most this often
+ALIAS_MAPPING_TTL_SECONDS = 60
+
+# Identical texts (bot boilerplate, repeated user messages) reuse one Milvus row
+EMBED_CACHE_MAX_SIZE = 4096
+
+# Only the most recent former aliases are kept on a User node
+MAX_OTHER_NAMES = 20
+
+# Cypher is kept in fixed module-level strings so every call reuses Neo4j's cached plan
+
+# User reads project only the profile fields callers use, so no Node objects are built
+USER_PROJECTION = """
+    u.user_id AS user_id, u.alias AS alias, u.username AS username, u.dm_channel_id AS dm_channel_id,
+    u.other_names AS other_names, u.last_active_channel_id AS last_active_channel_id,
+    u.last_active_timestamp AS last_active_timestamp
+"""
+
+MERGE_USER_QUERY = """
+    MERGE (u:User {user_id: $user_id})
+    ON CREATE SET u.username = $username,
+                  u.alias = $username,
+                  u.other_names = [],
+                  u.dm_channel_id = $dm_channel_id,
+                  u.created_at = $timestamp,
+                  u.last_active_channel_id = null,
+                  u.last_active_timestamp = null
+    ON MATCH SET u.username = $username
+    RETURN """ + USER_PROJECTION
+
+UPDATE_USER_ALIAS_QUERY = """
+    MATCH (u:User {user_id: $user_id})
+    SET u.username = $username
+    SET u.other_names = CASE
+        WHEN u.alias IS NOT NULL AND u.alias <> $new_alias
+        THEN apoc.coll.toSet(coalesce(u.other_names, []) + u.alias)[-$max_other_names..]
+        ELSE u.other_names
+    END
+    SET u.alias = $new_alias
+    RETURN """ + USER_PROJECTION
+
+UPDATE_USER_DM_CHANNEL_QUERY = """
+    MATCH (u:User {user_id: $user_id})
+    WHERE u.dm_channel_id IS NULL OR u.dm_channel_id <> $dm_channel_id
+    SET u.dm_channel_id = $dm_channel_id
+    RETURN u.user_id
+"""
+
+UPDATE_USER_LAST_ACTIVE_QUERY = """
+    MATCH (u:User {user_id: $user_id})
+    SET u.last_active_channel_id = $channel_id,
+        u.last_active_timestamp = $timestamp
+    RETURN u.user_id
+"""
+
+GET_USER_QUERY = "MATCH (u:User {user_id: $user_id}) RETURN " + USER_PROJECTION
+
+GET_USERS_QUERY = "MATCH (u:User) WHERE u.user_id IN $user_ids RETURN " + USER_PROJECTION
+
+GET_USER_BY_NAME_QUERY = """
+    MATCH (u:User)
+    WHERE u.alias = $name OR $name IN u.other_names
+    RETURN u.user_id AS userId
+    LIMIT 1
+"""
+
+# Driven from the User key seek; callers ensure the user exists first (add_new_user)
+MERGE_INTERACTION_QUERY = """
+    MATCH (u:User {user_id: $user_id})
+    MERGE (i:Interaction {id: $interaction_id})
+    ON CREATE SET i.timestamp = $timestamp
+    ON MATCH SET i.timestamp = $timestamp
+    MERGE (u)-[:INITIATED]->(i)
+    RETURN i.id AS interaction_id
+"""
+
+# The unit subquery links the action when the interaction exists without
+# dropping the action when it doesn't, all in one round trip
+CREATE_ACTION_QUERY = """
+    CREATE (a:Action $properties)
+    WITH a
+    CALL {
+        WITH a
+        MATCH (i:Interaction {id: $interaction_id})
+        CREATE (i)-[:INCLUDES]->(a)
+    }
+    RETURN elementId(a) AS action_node_id
+"""
+
+USERS_FOR_ALIAS_MAPPING_QUERY = """
+    MATCH (u:User) WHERE u.user_id IS NOT NULL
+    RETURN u.user_id AS user_id, u.alias AS alias, u.username AS username, u.other_names AS other_names
+"""
+
+# is_dm is not stored on Message; a channel is a DM when it is some User's dm_channel_id.
+# Messages written before that change still carry their own is_dm, which wins.
+MESSAGE_IS_DM = "coalesce(msg.is_dm, EXISTS { MATCH (:User {dm_channel_id: msg.channel_id}) })"
+
+HISTORY_BUNDLE_QUERY = """
+    CALL {
+        MATCH (msg:Message) WHERE msg.channel_id IN $priority_channel_ids
+        WITH msg ORDER BY msg.timestamp DESC LIMIT $priority_limit
+        RETURN 'priority' AS kind, msg {.message_id, .author_user_id, .role, .content_stored, .timestamp,
+                                        .token_count, .channel_id, .interaction_id, is_dm: """ + MESSAGE_IS_DM + """} AS item
+        UNION ALL
+        MATCH (msg:Message) WHERE msg.channel_id IN $supplementary_channel_ids
+                              AND msg.timestamp >= $supplementary_oldest_timestamp_cutoff
+        WITH msg ORDER BY msg.timestamp DESC LIMIT $supplementary_limit
+        RETURN 'supplementary' AS kind, msg {.message_id, .author_user_id, .role, .content_stored, .timestamp,
+                                             .token_count, .channel_id, .interaction_id, is_dm: """ + MESSAGE_IS_DM + """} AS item
+        UNION ALL
+        MATCH (a:Action) WHERE a.timestamp >= $actions_oldest_timestamp_cutoff
+        RETURN 'actions' AS kind, a {.action_id, .action_type, .timestamp, .reason, .result_summary} AS item
+    }
+    RETURN kind, item
+    ORDER BY coalesce(item.timestamp, 0) DESC
+"""
+
+# Each Message and Action is reached once through its own interaction, so no dedup is needed
+TIMELINE_FOR_INTERACTIONS_QUERY = """
+    MATCH (i:Interaction) WHERE i.id IN $interaction_ids
+    OPTIONAL MATCH (i)<-[:PART_OF_INTERACTION]-(msg:Message)
+    WITH i, collect({type: 'Message', data: properties(msg)}) AS messages
+    OPTIONAL MATCH (i)-[:INCLUDES]->(act:Action)
+    WITH messages, collect({type: 'Action', data: properties(act)}) AS actions
+    UNWIND messages + actions AS event
+    WITH event WHERE event.data IS NOT NULL
+    RETURN event
+    ORDER BY event.data.timestamp
+"""
+
+# Finds all messages in the given channels, gets their unique parent interaction IDs,
+# and returns the most recent ones.
+RECENT_INTERACTION_IDS_QUERY = """
+    MATCH (msg:Message)-[:PART_OF_INTERACTION]->(i:Interaction)
+    WHERE msg.channel_id IN $channel_ids
+    RETURN DISTINCT i.id AS interactionId, max(i.timestamp) as lastTimestamp
+    ORDER BY lastTimestamp DESC
+    LIMIT $limit
+"""
+
+MESSAGES_FROM_CHANNELS_QUERY = """
+    MATCH (msg:Message) WHERE msg.channel_id IN $channel_ids
+    RETURN msg.message_id AS message_id, msg.author_user_id AS author_user_id, msg.role AS role,
+           msg.content_stored AS content_stored, msg.timestamp AS timestamp, msg.token_count AS token_count,
+           msg.channel_id AS channel_id, msg.interaction_id AS interaction_id, """ + MESSAGE_IS_DM + """ AS is_dm
+    ORDER BY msg.timestamp DESC LIMIT $limit
+"""
+
+MESSAGES_FROM_CHANNELS_SINCE_QUERY = """
+    MATCH (msg:Message) WHERE msg.channel_id IN $channel_ids AND msg.timestamp >= $oldest_timestamp_cutoff
+    RETURN msg.message_id AS message_id, msg.author_user_id AS author_user_id, msg.role AS role,
+           msg.content_stored AS content_stored, msg.timestamp AS timestamp, msg.token_count AS token_count,
+           msg.channel_id AS channel_id, msg.interaction_id AS interaction_id, """ + MESSAGE_IS_DM + """ AS is_dm
+    ORDER BY msg.timestamp DESC LIMIT $limit
+"""
+
+MERGE_MESSAGES_QUERY = """
+    UNWIND $rows AS props
+    MERGE (msg:Message {message_id: props.message_id})
+    ON CREATE SET msg = props
+    ON MATCH SET msg += props
+    WITH msg, props
+    MATCH (u:User {user_id: props.author_user_id})
+    MATCH (i:Interaction {id: props.interaction_id})
+    MERGE (u)-[:SENT_MESSAGE]->(msg)
+    MERGE (msg)-[:PART_OF_INTERACTION]->(i)
+    RETURN msg
+"""
+
+@functools.lru_cache(maxsize=64)
+def _create_node_query(node_type: str) -> str:
+    """Labels can't be parameters, so one fixed query string is built and reused per label."""
+    return f"CREATE (n:{node_type} $properties) RETURN n, elementId(n) AS element_id"
+
+# Labels with a milvus_id index (see initialize_schema); None means return every property
+MILVUS_ID_INDEXED_PROJECTIONS = {
+    "Message": """n.message_id AS message_id, n.content_stored AS content, n.channel_id AS channel_id,
+    n.timestamp AS timestamp, n.milvus_id AS milvus_id""",
+    "Topic": None,
+}
+
+@functools.lru_cache(maxsize=64)
+def _nodes_by_milvus_ids_query(safe_label: str | None) -> str:
+    """One fixed query string per label (or none) for get_nodes_by_milvus_ids."""
+    if safe_label in MILVUS_ID_INDEXED_PROJECTIONS:
+        # Force the milvus_id index seek instead of a label scan
+        projection = MILVUS_ID_INDEXED_PROJECTIONS[safe_label] or "properties(n) AS node_properties"
+        return f"""
+    MATCH (n:{safe_label}) USING INDEX n:{safe_label}(milvus_id)
+    WHERE n.milvus_id IN $milvus_ids
+    RETURN {projection}
+"""
+    match_clause = f"MATCH (n:{safe_label})" if safe_label else "MATCH (n)"
+    return f"""
+    {match_clause}
+    WHERE n.milvus_id IN $milvus_ids
+    RETURN properties(n) AS node_properties
+"""
+
+# Transaction functions for execute_read/execute_write, which retry them on transient errors
+# (leader switches, deadlocks). Results are materialized inside the transaction.
+def _single_tx(tx, query, params):
+    return tx.run(query, params).single()
+
+async def _async_single_tx(tx, query, params):
+    result = await tx.run(query, params)
+    return await result.single()
+
+async def _async_records_tx(tx, query, params):
+    result = await tx.run(query, params)
+    return [record async for record in result]
 
 class Neo4jManager:
     def __init__(self):
         self.uri = os.getenv("NEO4J_URI", "bolt://neo4j:7687")
         self.user = os.getenv("NEO4J_USER", "neo4j")
         self.password = os.getenv("NEO4J_PASSWORD", "password")
+        # Naming the database up front saves the driver a home-database lookup per session
+        self.database = os.getenv("NEO4J_DATABASE", "neo4j")
         self.timezone = pytz.timezone(os.getenv('TIMEZONE', 'UTC'))
         self.driver = None
+        self.async_driver = None  # Used by the async write paths so they never block the event loop
+        self._message_write_queue = None
+        self._message_write_worker = None
+        self._embed_cache: OrderedDict[str, int] = OrderedDict()  # text digest -> milvus_id
+        self._embed_inflight: dict[str, asyncio.Future] = {}
+        self._dm_channel: OrderedDict[str, str] = OrderedDict()  # user_id -> dm_channel_id
+        self._last_active: OrderedDict[str, tuple[str, int]] = OrderedDict()  # user_id -> (channel_id, timestamp)
+        self._alias_cache: tuple[float, list[dict]] = (0.0, [])  # (monotonic fetch time, users)
         self.database_manager = DatabaseManager()
         self.connect()
         self.initialize_schema()
 
     def connect(self):
-        """Connect to Neo4j with retry logic."""
-        retries = 5
+        """Connect to Neo4j, retrying with jittered exponential backoff."""
+        retries = CONNECT_RETRIES
         for attempt in range(retries):
             try:
-                self.driver = GraphDatabase.driver(self.uri, auth=(self.user, self.password))
-                with self.driver.session() as session:
-                    result = session.run("RETURN 'Neo4j is connected!' AS message")
-                    message = result.single()["message"]
-                    dev_logger.debug(f"Neo4j connection successful: {message}")
-                    return
+                self.driver = GraphDatabase.driver(
+                    self.uri, auth=(self.user, self.password),
+                    max_connection_pool_size=50,
+                    connection_acquisition_timeout=30,
+                    max_connection_lifetime=3600,
+                    keep_alive=True
+                )
+                self.driver.verify_connectivity()
+                dev_logger.debug("Neo4j connection successful")
+                self.async_driver = AsyncGraphDatabase.driver(
+                    self.uri, auth=(self.user, self.password),
+                    max_connection_pool_size=50,
+                    connection_acquisition_timeout=30,
+                    max_connection_lifetime=3600,
+                    keep_alive=True
+                )
+                return
             except Exception as e:
+                if self.driver:
+                    self.driver.close()
+                    self.driver = None
                 if attempt < retries - 1:
-                    dev_logger.warning(f"Failed to connect to Neo4j (attempt {attempt + 1}/{retries}): {e}")
-                    import time
-                    time.sleep(5)
+                    delay = min(CONNECT_BACKOFF_MAX_SECONDS, CONNECT_BACKOFF_BASE_SECONDS * (2 ** attempt))
+                    delay *= random.uniform(0.8, 1.2)
+                    dev_logger.warning(f"Failed to connect to Neo4j (attempt {attempt + 1}/{retries}), retrying in {delay:.1f}s: {e}")
+                    time.sleep(delay)
                 else:
                     dev_logger.error(f"Failed to connect to Neo4j after {retries} attempts: {e}")
                     raise
@@ -49,10 +307,19 @@ class Neo4jManager:
             self.driver.close()
             dev_logger.debug("Neo4j connection closed")
 
+    async def close_async(self):
+        """Close both the async and sync Neo4j drivers. Called on bot shutdown."""
+        if self._message_write_worker and not self._message_write_worker.done():
+            self._message_write_worker.cancel()
+        if self.async_driver:
+            await self.async_driver.close()
+            self.async_driver = None
+        self.close()
+
     def initialize_schema(self):
         """Initialize the Neo4j schema with constraints and performance indexes."""
         try:
-            with self.driver.session() as session:
+            with self.driver.session(database=self.database) as session:
                 # Uniqueness constraints
                 session.run("CREATE CONSTRAINT user_id_unique IF NOT EXISTS FOR (u:User) REQUIRE u.user_id IS UNIQUE")
                 neo4j_logger.info("Ensured User.user_id uniqueness constraint.")
@@ -67,6 +334,15 @@ class Neo4jManager:
                 session.run("CREATE INDEX topic_milvus_id IF NOT EXISTS FOR (n:Topic) ON (n.milvus_id)")
                 neo4j_logger.info("Ensured index exists for Topic.milvus_id.")
 
+                # Channel history reads filter on channel_id and a timestamp range, newest first
+                session.run("CREATE INDEX message_channel_ts IF NOT EXISTS FOR (m:Message) ON (m.channel_id, m.timestamp)")
+                neo4j_logger.info("Ensured composite index exists for Message(channel_id, timestamp).")
+                session.run("CREATE INDEX message_role_ts IF NOT EXISTS FOR (m:Message) ON (m.role, m.timestamp)")
+                neo4j_logger.info("Ensured composite index exists for Message(role, timestamp).")
+                # Backs the is_dm derivation on message reads
+                session.run("CREATE INDEX user_dm_channel_id IF NOT EXISTS FOR (u:User) ON (u.dm_channel_id)")
+                neo4j_logger.info("Ensured index exists for User.dm_channel_id.")
+
                 result = session.run("SHOW CONSTRAINTS")
                 constraints = [record for record in result]
                 if constraints:
@@ -81,16 +357,46 @@ class Neo4jManager:
             raise
 
     async def _get_milvus_id_for_text(self, text_to_embed: str, metadata: dict) -> int | None:
-        """Generates embedding and inserts into Milvus, returning the Milvus ID."""
+        """
+        Returns the Milvus ID for the text, embedding and inserting it only if the same text
+        has not been stored recently. Concurrent calls for the same text share one insert.
+        """
         if not text_to_embed or not text_to_embed.strip():
             dev_logger.warning("No text provided for embedding, skipping.")
             return None
+        text_key = hashlib.blake2b(text_to_embed.encode(), digest_size=16).hexdigest()
+        milvus_id = self._embed_cache.get(text_key)
+        if milvus_id is not None:
+            self._embed_cache.move_to_end(text_key)
+            dev_logger.debug(f"Reusing Milvus ID {milvus_id} for previously embedded text.")
+            return milvus_id
+        inflight = self._embed_inflight.get(text_key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._embed_inflight[text_key] = future
+        milvus_id = None
+        try:
+            milvus_id = await self._embed_and_insert(text_to_embed, metadata)
+        finally:
+            del self._embed_inflight[text_key]
+            future.set_result(milvus_id)
+        if milvus_id is not None:
+            self._embed_cache[text_key] = milvus_id
+            if len(self._embed_cache) > EMBED_CACHE_MAX_SIZE:
+                self._embed_cache.popitem(last=False)
+        return milvus_id
+
+    async def _embed_and_insert(self, text_to_embed: str, metadata: dict) -> int | None:
+        """Generates embedding and inserts into Milvus, returning the Milvus ID."""
         try:
             embedding_vector = await generate_embedding(text_to_embed, use_secondary=True)
             if embedding_vector is not None and embedding_vector.any():
                 milvus_id = await self.database_manager.insert_everything(
                     text_to_embed=text_to_embed,
-                    metadata=metadata
+                    metadata=metadata,
+                    embedding=embedding_vector
                 )
                 dev_logger.debug(f"Content embedded and stored in Milvus with ID: {milvus_id}")
                 return milvus_id
@@ -117,9 +423,8 @@ class Neo4jManager:
                 milvus_metadata['interaction_id'] = interaction_id
             properties['milvus_id'] = await self._get_milvus_id_for_text(text_to_embed, milvus_metadata)
         try:
-            with self.driver.session() as session:
-                query = f"CREATE (n:{node_type} $properties) RETURN n, elementId(n) AS element_id"
-                result_record = session.run(query, properties=properties).single()
+            async with self.async_driver.session(database=self.database) as session:
+                result_record = await session.execute_write(_async_single_tx, _create_node_query(node_type), {'properties': properties})
                 if result_record:
                     created_node_props = dict(result_record['n'])
                     element_id = result_record['element_id']
@@ -135,23 +440,14 @@ class Neo4jManager:
     def create_user(self, user_id: str, username: str, dm_channel_id: str = None):
         """Create a new user in Neo4j or ensure existing user's username is current."""
         try:
-            with self.driver.session() as session:
+            with self.driver.session(database=self.database) as session:
                 timestamp = int(datetime.now(self.timezone).timestamp())
-                result = session.run("""
-                    MERGE (u:User {user_id: $user_id})
-                    ON CREATE SET u.username = $username,
-                                  u.alias = $username,
-                                  u.other_names = [],
-                                  u.dm_channel_id = $dm_channel_id,
-                                  u.created_at = $timestamp,
-                                  u.last_active_channel_id = null,
-                                  u.last_active_timestamp = null
-                    ON MATCH SET u.username = $username
-                    RETURN u
-                """, user_id=user_id, username=username, dm_channel_id=dm_channel_id, timestamp=timestamp)
-                user_node = result.single()['u']
-                neo4j_logger.info(f"Ensured user '{username}' (ID: {user_id}) exists in Neo4j. Properties: {dict(user_node)}")
-                return dict(user_node)
+                user_node = dict(session.execute_write(_single_tx, MERGE_USER_QUERY, {
+                    'user_id': user_id, 'username': username, 'dm_channel_id': dm_channel_id, 'timestamp': timestamp
+                }))
+                self._alias_cache = (0.0, [])
+                neo4j_logger.info(f"Ensured user '{username}' (ID: {user_id}) exists in Neo4j. Properties: {user_node}")
+                return user_node
         except Exception as e:
             dev_logger.error(f"Failed to create/merge user {user_id} in Neo4j: {e}", exc_info=True)
             return None
@@ -159,22 +455,14 @@ class Neo4jManager:
     def update_user_alias(self, user_id: str, new_alias: str, username: str):
         """Update a user's alias and ensure their username property is current."""
         try:
-            with self.driver.session() as session:
-                result = session.run("""
-                    MATCH (u:User {user_id: $user_id})
-                    SET u.username = $username
-                    SET u.other_names = CASE
-                        WHEN u.alias IS NOT NULL AND u.alias <> $new_alias AND NOT u.alias IN u.other_names
-                        THEN u.other_names + u.alias
-                        ELSE u.other_names
-                    END
-                    SET u.alias = $new_alias
-                    RETURN u
-                """, user_id=user_id, new_alias=new_alias, username=username)
-                user = result.single()
+            with self.driver.session(database=self.database) as session:
+                user = session.execute_write(_single_tx, UPDATE_USER_ALIAS_QUERY, {
+                    'user_id': user_id, 'new_alias': new_alias, 'username': username, 'max_other_names': MAX_OTHER_NAMES
+                })
                 if user:
+                    self._alias_cache = (0.0, [])
                     neo4j_logger.info(f"Updated alias for user {user_id} to '{new_alias}'. Username set to '{username}'.")
-                    return dict(user["u"])
+                    return dict(user)
                 else:
                     dev_logger.warning(f"Attempted to update alias for non-existent user {user_id}.")
                     return None
@@ -182,32 +470,37 @@ class Neo4jManager:
             dev_logger.error(f"Failed to update alias for user {user_id} in Neo4j: {e}", exc_info=True)
             return None
 
+    @staticmethod
+    def _remember(cache: OrderedDict, key: str, value):
+        """Stores value as the most recently used entry of a bounded per-user write cache."""
+        cache[key] = value
+        cache.move_to_end(key)
+        if len(cache) > USER_WRITE_CACHE_MAX_SIZE:
+            cache.popitem(last=False)
+
     def update_user_dm_channel(self, user_id: str, dm_channel_id: str):
-        """Update the dm_channel_id for a user."""
+        """Update the dm_channel_id for a user. Skipped when it matches the last value written."""
+        if self._dm_channel.get(user_id) == dm_channel_id:
+            self._dm_channel.move_to_end(user_id)
+            return
         try:
-            with self.driver.session() as session:
-                result = session.run("""
-                    MATCH (u:User {user_id: $user_id})
-                    WHERE u.dm_channel_id IS NULL OR u.dm_channel_id <> $dm_channel_id
-                    SET u.dm_channel_id = $dm_channel_id
-                    RETURN u
-                """, user_id=user_id, dm_channel_id=dm_channel_id)
-                if result.single():
+            with self.driver.session(database=self.database) as session:
+                if session.execute_write(_single_tx, UPDATE_USER_DM_CHANNEL_QUERY, {'user_id': user_id, 'dm_channel_id': dm_channel_id}):
                     neo4j_logger.info(f"Updated dm_channel_id for user {user_id} to '{dm_channel_id}' in Neo4j.")
+            # No row also means the stored value already matched
+            self._remember(self._dm_channel, user_id, dm_channel_id)
         except Exception as e:
             dev_logger.error(f"Failed to update dm_channel_id for user {user_id} in Neo4j: {e}", exc_info=True)
 
     def update_user_last_active_info(self, user_id: str, channel_id: str, timestamp: int):
-        """Updates the last active channel and timestamp for a user."""
+        """Updates the last active channel and timestamp for a user. Skipped when nothing changed."""
+        if self._last_active.get(user_id) == (channel_id, timestamp):
+            self._last_active.move_to_end(user_id)
+            return
         try:
-            with self.driver.session() as session:
-                result = session.run("""
-                    MATCH (u:User {user_id: $user_id})
-                    SET u.last_active_channel_id = $channel_id,
-                        u.last_active_timestamp = $timestamp
-                    RETURN u.user_id
-                """, user_id=user_id, channel_id=channel_id, timestamp=timestamp)
-                if result.single():
+            with self.driver.session(database=self.database) as session:
+                if session.execute_write(_single_tx, UPDATE_USER_LAST_ACTIVE_QUERY, {'user_id': user_id, 'channel_id': channel_id, 'timestamp': timestamp}):
+                    self._remember(self._last_active, user_id, (channel_id, timestamp))
                     neo4j_logger.info(f"Updated last active info for user {user_id}: channel {channel_id}, timestamp {timestamp}.")
                 else:
                     dev_logger.warning(f"Could not find user {user_id} to update last active info.")
@@ -217,26 +510,30 @@ class Neo4jManager:
     def get_user(self, user_id: str):
         """Retrieve a user's profile from Neo4j by their Discord User ID."""
         try:
-            with self.driver.session() as session:
-                result = session.run("MATCH (u:User {user_id: $user_id}) RETURN u", user_id=user_id)
-                user_record = result.single()
-                return dict(user_record["u"]) if user_record else None
+            records, _, _ = self.driver.execute_query(
+                GET_USER_QUERY, user_id=user_id,
+                database_=self.database, routing_=RoutingControl.READ
+            )
+            return dict(records[0]) if records else None
         except Exception as e:
             dev_logger.error(f"Failed to retrieve user {user_id} from Neo4j: {e}", exc_info=True)
             return None
 
+    def get_users(self, user_ids: list[str]) -> dict[str, dict]:
+        """Retrieve several users' profiles in one query, keyed by Discord User ID."""
+        if not user_ids: return {}
+        try:
+            records, _, _ = self.driver.execute_query(GET_USERS_QUERY, user_ids=list(user_ids), database_=self.database, routing_=RoutingControl.READ)
+            return {record["user_id"]: dict(record) for record in records}
+        except Exception as e:
+            dev_logger.error(f"Failed to retrieve users {user_ids} from Neo4j: {e}", exc_info=True)
+            return {}
+
     def get_user_by_name(self, name: str):
         """Find a user by their current alias or one of their other_names."""
         try:
-            with self.driver.session() as session:
-                result = session.run("""
-                    MATCH (u:User)
-                    WHERE u.alias = $name OR $name IN u.other_names
-                    RETURN u.user_id AS userId
-                    LIMIT 1
-                """, name=name)
-                user_record = result.single()
-                return user_record["userId"] if user_record else None
+            records, _, _ = self.driver.execute_query(GET_USER_BY_NAME_QUERY, name=name, database_=self.database, routing_=RoutingControl.READ)
+            return records[0]["userId"] if records else None
         except Exception as e:
             dev_logger.error(f"Failed to find user by name '{name}' in Neo4j: {e}", exc_info=True)
             return None
@@ -244,15 +541,13 @@ class Neo4jManager:
     async def create_interaction(self, user_id: str, interaction_id: str, timestamp: int):
         """Create an Interaction node linked to a User."""
         try:
-            with self.driver.session() as session:
-                session.run("""
-                    MERGE (i:Interaction {id: $interaction_id})
-                    ON CREATE SET i.timestamp = $timestamp
-                    ON MATCH SET i.timestamp = $timestamp
-                    WITH i
-                    MATCH (u:User {user_id: $user_id})
-                    MERGE (u)-[:INITIATED]->(i)
-                """, interaction_id=interaction_id, timestamp=timestamp, user_id=user_id)
+            async with self.async_driver.session(database=self.database) as session:
+                record = await session.execute_write(_async_single_tx, MERGE_INTERACTION_QUERY, {
+                    'interaction_id': interaction_id, 'timestamp': timestamp, 'user_id': user_id
+                })
+                if record is None:
+                    dev_logger.warning(f"User {user_id} not found; interaction {interaction_id} was not created.")
+                    return
             neo4j_logger.info(f"Ensured interaction {interaction_id} (ts: {timestamp}) by user {user_id} and [:INITIATED] link.")
         except Exception as e:
             dev_logger.error(f"Failed to create interaction {interaction_id}: {e}", exc_info=True)
@@ -265,14 +560,8 @@ class Neo4jManager:
             if reason: properties['reason'] = reason
             if result_summary: properties['result_summary'] = result_summary
             if tool_call_id: properties['tool_call_id'] = tool_call_id
-            with self.driver.session() as session:
-                result = session.run("CREATE (a:Action $properties) RETURN elementId(a) AS action_node_id", properties=properties)
-                action_node_id = result.single()['action_node_id']
-                session.run("""
-                    MATCH (i:Interaction {id: $interaction_id})
-                    MATCH (a:Action) WHERE elementId(a) = $action_node_id
-                    MERGE (i)-[:INCLUDES]->(a)
-                """, interaction_id=interaction_id, action_node_id=action_node_id)
+            async with self.async_driver.session(database=self.database) as session:
+                await session.execute_write(_async_single_tx, CREATE_ACTION_QUERY, {'properties': properties, 'interaction_id': interaction_id})
             log_msg = f"Inserted action '{action_type}' for interaction {interaction_id}."
             neo4j_logger.info(log_msg)
         except Exception as e:
@@ -280,106 +569,189 @@ class Neo4jManager:
             raise
 
     async def create_message_node(self, message_id: str, author_user_id: str, interaction_id: str,
-                                  channel_id: str, is_dm: bool, role: str, content_to_store: str,
+                                  channel_id: str, role: str, content_to_store: str,
                                   timestamp: int, token_count: int,
                                   length_chars: int = None, has_attachments: bool = None):
         """Creates a :Message node and its embedding, linking it to the :User and :Interaction."""
         try:
-            milvus_metadata = {
-                "type": "message", "message_id": message_id, "user_id": author_user_id,
-                "interaction_id": interaction_id, "role": role, "channel_id": channel_id,
-                "timestamp": timestamp, "token_count": token_count
-            }
-            milvus_id_from_db = await self._get_milvus_id_for_text(content_to_store, milvus_metadata)
-            message_properties = {
-                'message_id': message_id, 'author_user_id': author_user_id,
-                'interaction_id': interaction_id, 'channel_id': channel_id,
-                'is_dm': is_dm, 'role': role, 'content_stored': content_to_store,
-                'timestamp': timestamp, 'milvus_id': milvus_id_from_db,
-                'token_count': token_count,
-                'length_chars': length_chars if length_chars is not None else len(content_to_store),
-                'has_attachments': has_attachments if has_attachments is not None else False
-            }
-            with self.driver.session() as session:
-                result = session.run("""
-                    MERGE (msg:Message {message_id: $props.message_id})
-                    ON CREATE SET msg = $props
-                    ON MATCH SET msg += $props
-                    WITH msg, $props.author_user_id AS authorId, $props.interaction_id AS interactionIdVal
-                    MATCH (u:User {user_id: authorId})
-                    MATCH (i:Interaction {id: interactionIdVal})
-                    MERGE (u)-[:SENT_MESSAGE]->(msg)
-                    MERGE (msg)-[:PART_OF_INTERACTION]->(i)
-                    RETURN msg
-                """, props=message_properties)
-                created_msg_node = result.single()['msg']
-                neo4j_logger.info(f"Ensured Message node '{message_id}' exists and is linked.")
-                return dict(created_msg_node)
+            message_properties = await self._build_message_properties(
+                message_id=message_id, author_user_id=author_user_id, interaction_id=interaction_id,
+                channel_id=channel_id, role=role, content_to_store=content_to_store,
+                timestamp=timestamp, token_count=token_count,
+                length_chars=length_chars, has_attachments=has_attachments
+            )
+            created_msg_node = await self._enqueue_message_write(message_properties)
+            neo4j_logger.info(f"Ensured Message node '{message_id}' exists and is linked.")
+            return created_msg_node
         except Exception as e:
             dev_logger.error(f"Failed to create/link message node '{message_id}': {e}", exc_info=True)
             raise
 
+    async def create_message_nodes_batch(self, rows: list[dict]) -> list[dict]:
+        """
+        Bulk version of create_message_node for backfills. Each row holds create_message_node's
+        keyword arguments. Embeddings run concurrently and the nodes are upserted with one UNWIND
+        statement per MESSAGE_WRITE_BATCH_MAX_SIZE rows. Returns the stored nodes; rows whose
+        User or Interaction is missing are skipped.
+        """
+        if not rows: return []
+        try:
+            all_properties = await asyncio.gather(*(self._build_message_properties(**row) for row in rows))
+            stored_nodes = []
+            async with self.async_driver.session(database=self.database) as session:
+                for start in range(0, len(all_properties), MESSAGE_WRITE_BATCH_MAX_SIZE):
+                    records = await session.execute_write(_async_records_tx, MERGE_MESSAGES_QUERY, {'rows': all_properties[start:start + MESSAGE_WRITE_BATCH_MAX_SIZE]})
+                    stored_nodes.extend(dict(record['msg']) for record in records)
+            neo4j_logger.info(f"Ensured {len(stored_nodes)}/{len(rows)} Message nodes exist and are linked.")
+            return stored_nodes
+        except Exception as e:
+            dev_logger.error(f"Failed to create/link {len(rows)} message nodes in batch: {e}", exc_info=True)
+            raise
+
+    async def _build_message_properties(self, message_id: str, author_user_id: str, interaction_id: str,
+                                        channel_id: str, role: str, content_to_store: str,
+                                        timestamp: int, token_count: int,
+                                        length_chars: int = None, has_attachments: bool = None) -> dict:
+        """Embeds the message content into Milvus and returns the :Message node properties."""
+        milvus_metadata = {
+            "type": "message", "message_id": message_id, "user_id": author_user_id,
+            "interaction_id": interaction_id, "role": role, "channel_id": channel_id,
+            "timestamp": timestamp, "token_count": token_count
+        }
+        milvus_id_from_db = await self._get_milvus_id_for_text(content_to_store, milvus_metadata)
+        return {
+            'message_id': message_id, 'author_user_id': author_user_id,
+            'interaction_id': interaction_id, 'channel_id': channel_id,
+            'role': role, 'content_stored': content_to_store,
+            'timestamp': timestamp, 'milvus_id': milvus_id_from_db,
+            'token_count': token_count,
+            'length_chars': length_chars if length_chars is not None else len(content_to_store),
+            'has_attachments': has_attachments if has_attachments is not None else False
+        }
+
+    async def _enqueue_message_write(self, message_properties: dict) -> dict:
+        """Hands a Message row to the write worker and waits for the stored node."""
+        if self._message_write_worker is None or self._message_write_worker.done():
+            self._message_write_queue = asyncio.Queue(maxsize=MESSAGE_WRITE_QUEUE_SIZE)
+            self._message_write_worker = asyncio.create_task(self._message_write_loop())
+        future = asyncio.get_running_loop().create_future()
+        await self._message_write_queue.put((message_properties, future))
+        return await future
+
+    async def _message_write_loop(self):
+        """Upserts queued Message rows, one UNWIND statement per batch."""
+        while True:
+            batch = [await self._message_write_queue.get()]
+            while len(batch) < MESSAGE_WRITE_BATCH_MAX_SIZE:
+                try:
+                    batch.append(self._message_write_queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            await self._write_message_batch(batch)
+
+    async def _write_message_batch(self, batch: list[tuple[dict, asyncio.Future]]):
+        try:
+            async with self.async_driver.session(database=self.database) as session:
+                records = await session.execute_write(_async_records_tx, MERGE_MESSAGES_QUERY, {'rows': [props for props, _ in batch]})
+                stored = {record['msg']['message_id']: dict(record['msg']) for record in records}
+            dev_logger.debug(f"Upserted {len(stored)}/{len(batch)} Message node(s) in one batch.")
+            for props, future in batch:
+                if future.done():
+                    continue
+                if props['message_id'] in stored:
+                    future.set_result(stored[props['message_id']])
+                else:
+                    future.set_exception(LookupError(f"User '{props['author_user_id']}' or Interaction '{props['interaction_id']}' not found for message '{props['message_id']}'"))
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
     def get_all_users_for_alias_mapping(self) -> list[dict]:
-        """Fetches all users to build the name-to-ID mapping for mentions."""
+        """
+        Fetches all users to build the name-to-ID mapping for mentions.
+        The result is shared for ALIAS_MAPPING_TTL_SECONDS (or until a user is created or renamed);
+        callers must not mutate it.
+        """
+        fetched_at, users_data = self._alias_cache
+        if fetched_at and time.monotonic() - fetched_at < ALIAS_MAPPING_TTL_SECONDS:
+            return users_data
         try:
-            with self.driver.session() as session:
-                result = session.run("""
-                    MATCH (u:User) WHERE u.user_id IS NOT NULL
-                    RETURN u.user_id AS user_id, u.alias AS alias, u.username AS username, u.other_names AS other_names
-                """)
-                users_data = [{"user_id": r["user_id"], "alias": r["alias"], "username": r["username"], "other_names": r["other_names"] or []} for r in result]
-                dev_logger.debug(f"Fetched {len(users_data)} users for alias mapping.")
-                return users_data
+            records, _, _ = self.driver.execute_query(USERS_FOR_ALIAS_MAPPING_QUERY, database_=self.database, routing_=RoutingControl.READ)
+            users_data = [{"user_id": r["user_id"], "alias": r["alias"], "username": r["username"], "other_names": r["other_names"] or []} for r in records]
+            self._alias_cache = (time.monotonic(), users_data)
+            dev_logger.debug(f"Fetched {len(users_data)} users for alias mapping.")
+            return users_data
         except Exception as e:
             dev_logger.error(f"Failed to fetch users for alias mapping: {e}", exc_info=True)
             return []
 
-    def get_messages_from_channels(self, channel_ids: list[str], oldest_timestamp_cutoff: int = None, limit: int = 200) -> list[dict]:
-        """Fetches messages from specified channels, newer than a cutoff, up to a limit."""
-        if not channel_ids: return []
+    def get_messages_from_channels(self, channel_ids: list[str], oldest_timestamp_cutoff: int = None, limit: int = 200) -> Iterator[dict]:
+        """
+        Streams messages from specified channels, newer than a cutoff, up to a limit, newest first.
+        Records are yielded as the server sends them, so the session stays open until the generator
+        is exhausted or closed; wrap in list() when the whole window is needed at once.
+        """
+        if not channel_ids: return
+        query = MESSAGES_FROM_CHANNELS_SINCE_QUERY if oldest_timestamp_cutoff else MESSAGES_FROM_CHANNELS_QUERY
+        fetched = 0
+        try:
+            with self.driver.session(database=self.database, default_access_mode=READ_ACCESS) as session:
+                with session.begin_transaction() as tx:
+                    for record in tx.run(query, channel_ids=channel_ids, oldest_timestamp_cutoff=oldest_timestamp_cutoff, limit=limit):
+                        fetched += 1
+                        yield dict(record)
+            dev_logger.debug(f"Streamed {fetched} messages from {len(channel_ids)} channels.")
+        except Exception as e:
+            dev_logger.error(f"Failed to fetch messages from channels {channel_ids} after {fetched} records: {e}", exc_info=True)
+
+    def get_history_bundle(self, priority_channel_ids: list[str], supplementary_channel_ids: list[str],
+                           supplementary_oldest_timestamp_cutoff: int, actions_oldest_timestamp_cutoff: int,
+                           priority_limit: int = 150, supplementary_limit: int = 50) -> dict[str, list[dict]]:
+        """
+        Fetches everything history building needs in a single round trip:
+        the newest priority-channel messages (no time cutoff, callers filter client-side),
+        recent supplementary-channel messages, and recent actions.
+        Returns a dict with 'priority', 'supplementary' and 'actions' lists, each newest first.
+        """
+        bundle = {'priority': [], 'supplementary': [], 'actions': []}
         try:
-            with self.driver.session() as session:
-                where_clauses = ["msg.channel_id IN $channel_ids"]
-                if oldest_timestamp_cutoff: where_clauses.append("msg.timestamp >= $oldest_timestamp_cutoff")
-                query = f"""
-                    MATCH (msg:Message) WHERE {" AND ".join(where_clauses)}
-                    RETURN msg.message_id AS message_id, msg.author_user_id AS author_user_id, msg.role AS role,
-                           msg.content_stored AS content_stored, msg.timestamp AS timestamp, msg.token_count AS token_count,
-                           msg.channel_id AS channel_id, msg.interaction_id AS interaction_id, msg.is_dm AS is_dm
-                    ORDER BY msg.timestamp DESC LIMIT $limit
-                """
-                result = session.run(query, channel_ids=channel_ids, oldest_timestamp_cutoff=oldest_timestamp_cutoff, limit=limit)
-                messages_data = [dict(record) for record in result]
-                dev_logger.debug(f"Fetched {len(messages_data)} messages from {len(channel_ids)} channels.")
-                return messages_data
+            records, _, _ = self.driver.execute_query(
+                HISTORY_BUNDLE_QUERY,
+                priority_channel_ids=list(priority_channel_ids),
+                supplementary_channel_ids=list(supplementary_channel_ids),
+                supplementary_oldest_timestamp_cutoff=supplementary_oldest_timestamp_cutoff,
+                actions_oldest_timestamp_cutoff=actions_oldest_timestamp_cutoff,
+                priority_limit=priority_limit,
+                supplementary_limit=supplementary_limit,
+                database_=self.database, routing_=RoutingControl.READ
+            )
+            for record in records:
+                bundle[record["kind"]].append(dict(record["item"]))
+            dev_logger.debug(f"Fetched history bundle: {len(bundle['priority'])} priority, {len(bundle['supplementary'])} supplementary messages, {len(bundle['actions'])} actions.")
         except Exception as e:
-            dev_logger.error(f"Failed to fetch messages from channels {channel_ids}: {e}", exc_info=True)
-            return []
+            dev_logger.error(f"Failed to fetch history bundle: {e}", exc_info=True)
+        return bundle
 
     # NEW: Universal node retrieval by Milvus ID
     def get_nodes_by_milvus_ids(self, milvus_ids: list[int], node_label: str = None) -> list[dict]:
         """
         Fetches full node data for any node type using a list of Milvus IDs.
         If node_label is provided, it restricts the search to that specific label for performance.
+        Message nodes come back as a projection (message_id, content, channel_id, timestamp, milvus_id).
         """
         if not milvus_ids:
             return []
         try:
-            with self.driver.session() as session:
-                if node_label:
-                    safe_label = "".join(filter(str.isalnum, node_label))
-                    match_clause = f"MATCH (n:{safe_label})"
-                else:
-                    match_clause = "MATCH (n)"
-                query = f"""
-                    {match_clause}
-                    WHERE n.milvus_id IN $milvus_ids
-                    RETURN properties(n) AS node_properties
-                """
-                result = session.run(query, milvus_ids=milvus_ids)
-                nodes_data = [dict(record["node_properties"]) for record in result]
-                dev_logger.debug(f"Fetched {len(nodes_data)} nodes from Neo4j using Milvus IDs (Label: {node_label or 'Any'}).")
-                return nodes_data
+            safe_label = "".join(filter(str.isalnum, node_label)) if node_label else None
+            query = _nodes_by_milvus_ids_query(safe_label)
+            records, _, _ = self.driver.execute_query(query, milvus_ids=milvus_ids, database_=self.database, routing_=RoutingControl.READ)
+            if MILVUS_ID_INDEXED_PROJECTIONS.get(safe_label):
+                nodes_data = [dict(record) for record in records]
+            else:
+                nodes_data = [dict(record["node_properties"]) for record in records]
+            dev_logger.debug(f"Fetched {len(nodes_data)} nodes from Neo4j using Milvus IDs (Label: {node_label or 'Any'}).")
+            return nodes_data
         except Exception as e:
             dev_logger.error(f"Failed to fetch nodes by Milvus IDs: {e}", exc_info=True)
             return []
@@ -388,29 +760,10 @@ class Neo4jManager:
         """Fetches all Message and Action nodes for given interaction IDs, returned as a sorted timeline."""
         if not interaction_ids: return []
         try:
-            with self.driver.session() as session:
-                query = """
-                    MATCH (i:Interaction) WHERE i.id IN $interaction_ids
-                    OPTIONAL MATCH (msg:Message)-[:PART_OF_INTERACTION]->(i)
-                    WITH i, {type: 'Message', data: properties(msg)} AS event WHERE event.data IS NOT NULL
-                    RETURN event
-                    UNION ALL
-                    MATCH (i:Interaction) WHERE i.id IN $interaction_ids
-                    OPTIONAL MATCH (act:Action)<-[:INCLUDES]-(i)
-                    WITH i, {type: 'Action', data: properties(act)} AS event WHERE event.data IS NOT NULL
-                    RETURN event
-                """
-                result = session.run(query, interaction_ids=interaction_ids)
-                unique_events = {}
-                for record in result:
-                    event_data = record.get("event")
-                    if not event_data or not event_data.get("data"): continue
-                    key = event_data["data"].get("message_id") or str(event_data["data"].get("timestamp")) + str(hash(event_data["data"].get("reason", "")))
-                    if key not in unique_events:
-                        unique_events[key] = event_data
-                sorted_timeline = sorted(list(unique_events.values()), key=lambda x: x['data']['timestamp'])
-                dev_logger.debug(f"Fetched {len(sorted_timeline)} unique timeline events for {len(interaction_ids)} interactions.")
-                return sorted_timeline
+            records, _, _ = self.driver.execute_query(TIMELINE_FOR_INTERACTIONS_QUERY, interaction_ids=interaction_ids, database_=self.database, routing_=RoutingControl.READ)
+            sorted_timeline = [record["event"] for record in records]
+            dev_logger.debug(f"Fetched {len(sorted_timeline)} timeline events for {len(interaction_ids)} interactions.")
+            return sorted_timeline
         except Exception as e:
             dev_logger.error(f"Failed to fetch timeline for interactions: {e}", exc_info=True)
             return []
@@ -422,20 +775,10 @@ class Neo4jManager:
         if not channel_ids:
             return []
         try:
-            with self.driver.session() as session:
-                # This query finds all messages in the specified channels,
-                # gets their unique parent interaction IDs, and returns the most recent ones.
-                query = """
-                    MATCH (msg:Message)-[:PART_OF_INTERACTION]->(i:Interaction)
-                    WHERE msg.channel_id IN $channel_ids
-                    RETURN DISTINCT i.id AS interactionId, max(i.timestamp) as lastTimestamp
-                    ORDER BY lastTimestamp DESC
-                    LIMIT $limit
-                """
-                result = session.run(query, channel_ids=channel_ids, limit=limit)
-                interaction_ids = [record["interactionId"] for record in result]
-                dev_logger.debug(f"Fetched {len(interaction_ids)} recent interaction IDs from {len(channel_ids)} channels.")
-                return interaction_ids
+            records, _, _ = self.driver.execute_query(RECENT_INTERACTION_IDS_QUERY, channel_ids=channel_ids, limit=limit, database_=self.database, routing_=RoutingControl.READ)
+            interaction_ids = [record["interactionId"] for record in records]
+            dev_logger.debug(f"Fetched {len(interaction_ids)} recent interaction IDs from {len(channel_ids)} channels.")
+            return interaction_ids
         except Exception as e:
             dev_logger.error(f"Failed to fetch recent interaction IDs: {e}", exc_info=True)
             return []
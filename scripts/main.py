@@ -1,10 +1,15 @@
 # main.py
 
 import os
+import time
+import queue
+import atexit
 import logging
+import logging.handlers
 import asyncio
-import textwrap
 from datetime import datetime, timezone as dt_timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import uvloop
 import discord
 from discord import Client
 from pathlib import Path
@@ -17,62 +22,109 @@ from knowledge_graph import Neo4jManager
 from media_manager import MediaManager
 from web_search import WebSearchManager
 from tinygen_controller import TinyGenController
-
-import pytz
-
-log_level_str = os.getenv('LOG_LEVEL', 'INFO').upper()
-log_level = getattr(logging, log_level_str, logging.INFO)
-
-logging.basicConfig(
-    level=log_level,
-    format='%(asctime)s [%(levelname)s] %(name)s: %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
-
-app_timezone_str = os.getenv('TIMEZONE', 'UTC')
-try:
-    app_timezone = pytz.timezone(app_timezone_str)
-except pytz.exceptions.UnknownTimeZoneError:
-    app_timezone = pytz.utc
-    logging.error(f"Unknown timezone '{app_timezone_str}' in .env. Defaulting to UTC.")
-
+from message_queue import ChannelPartitionedQueue
+import embeddings
 
 class TimezoneFormatter(logging.Formatter):
     def __init__(self, fmt=None, datefmt=None, tz=None):
         super().__init__(fmt, datefmt)
-        self.tz = tz if tz else pytz.utc
+        self.tz = tz if tz else dt_timezone.utc
+        # datefmt has one-second resolution, so records within the same second share one string
+        self._cached_second = None
+        self._cached_time = None
 
     def formatTime(self, record, datefmt=None):
-        dt = datetime.fromtimestamp(record.created, dt_timezone.utc).astimezone(self.tz)
         if datefmt:
-            return dt.strftime(datefmt)
-        return str(dt)
-
-log_dir_path = Path("data/logs")
-log_dir_path.mkdir(parents=True, exist_ok=True)
-current_timestamp_for_logs = datetime.now(app_timezone).strftime('%Y%m%d_%H%M%S')
-
-def setup_logger(logger_name, filename_prefix, level=logging.INFO, tz=app_timezone):
+            second = int(record.created)
+            if second != self._cached_second:
+                self._cached_time = datetime.fromtimestamp(second, self.tz).strftime(datefmt)
+                self._cached_second = second
+            return self._cached_time
+        return str(datetime.fromtimestamp(record.created, self.tz))
+
+LOG_DIR_PATH = Path("data/logs")
+
+# Handlers are attached by _bootstrap(); importing this module has no side effects
+thought_logger = logging.getLogger('thought')
+dev_logger = logging.getLogger('dev')
+neo4j_logger = logging.getLogger('neo4j')
+
+def setup_logger(logger_name, log_file_path, level=logging.INFO, tz=dt_timezone.utc):
+    """
+    File logger whose records are handed to a background QueueListener thread, so the
+    event loop only enqueues; timestamp formatting and the file write happen off-loop.
+    """
     logger = logging.getLogger(logger_name)
     logger.setLevel(level)
     if not logger.handlers:
-        handler = logging.FileHandler(log_dir_path / f'{filename_prefix}_{current_timestamp_for_logs}.log', encoding='utf-8')
+        file_handler = logging.FileHandler(log_file_path, encoding='utf-8')
         formatter = TimezoneFormatter('%(asctime)s [%(levelname)s] %(name)s %(module)s: %(message)s', datefmt='%Y-%m-%d %H:%M:%S %Z', tz=tz)
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
+        file_handler.setFormatter(formatter)
+        record_queue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(record_queue, file_handler)
+        listener.start()
+        # Drains whatever is still queued on interpreter exit
+        atexit.register(listener.stop)
+        logger.addHandler(logging.handlers.QueueHandler(record_queue))
         logger.propagate = False
     return logger
 
-thought_logger = setup_logger('thought', 'thought_log', logging.INFO, tz=app_timezone)
-dev_logger = setup_logger('dev', 'dev_debug_log', logging.DEBUG, tz=app_timezone)
-neo4j_logger = setup_logger('neo4j', 'neo4j_interaction_log', logging.INFO, tz=app_timezone)
+def _bootstrap():
+    """One-shot process setup: root logging, timezone resolution, log directory and file loggers."""
+    log_level = getattr(logging, os.getenv('LOG_LEVEL', 'INFO').upper(), logging.INFO)
+    logging.basicConfig(
+        level=log_level,
+        format='%(asctime)s [%(levelname)s] %(name)s: %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+
+    app_timezone_str = os.getenv('TIMEZONE', 'UTC')
+    try:
+        app_timezone = ZoneInfo(app_timezone_str)
+    except (ZoneInfoNotFoundError, ValueError):
+        app_timezone = dt_timezone.utc
+        logging.error(f"Unknown timezone '{app_timezone_str}' in .env. Defaulting to UTC.")
+
+    LOG_DIR_PATH.mkdir(parents=True, exist_ok=True)
+    current_timestamp_for_logs = datetime.now(app_timezone).strftime('%Y%m%d_%H%M%S')
+    for logger_name, filename_prefix, level in (
+        ('thought', 'thought_log', logging.INFO),
+        ('dev', 'dev_debug_log', logging.DEBUG),
+        ('neo4j', 'neo4j_interaction_log', logging.INFO),
+    ):
+        setup_logger(logger_name, LOG_DIR_PATH / f'{filename_prefix}_{current_timestamp_for_logs}.log', level, tz=app_timezone)
+
+# TinyGen housekeeping runs once Gen has had nothing to do for this long
+IDLE_SECONDS_THRESHOLD = 300
+
+DISCORD_MESSAGE_LIMIT = 2000
+# Shared "no files" argument for split sends; never mutated
+_EMPTY = []
+
+# Bounds memory when response generation stalls; overflow messages are kept for context but not answered
+MESSAGE_QUEUE_MAX_SIZE = 256
+# Same bound for messages waiting to be stored; past it new messages wait for a flush before being buffered
+PENDING_STORES_MAX_SIZE = 256
 
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
 
-def split_message(text, limit=2000):
-    return textwrap.wrap(text, width=limit, replace_whitespace=False, drop_whitespace=False, break_long_words=True, break_on_hyphens=False)
+def split_message(text, limit=DISCORD_MESSAGE_LIMIT):
+    """Splits text into chunks of at most `limit` chars, breaking after the last newline (else space) in each window."""
+    parts = []
+    start, length = 0, len(text)
+    while length - start > limit:
+        end = start + limit
+        cut = text.rfind('\n', start, end)
+        if cut <= start:
+            cut = text.rfind(' ', start, end)
+        cut = cut + 1 if cut > start else end
+        parts.append(text[start:cut])
+        start = cut
+    if start < length:
+        parts.append(text[start:])
+    return parts
 
 class DiscordBot(Client):
     def __init__(self, **options):
@@ -86,7 +138,7 @@ class DiscordBot(Client):
         self.web_search_manager = WebSearchManager()
         self.tinygen_controller = TinyGenController()
         
-        self.message_queue = asyncio.Queue()
+        self.message_queue = ChannelPartitionedQueue(maxsize=MESSAGE_QUEUE_MAX_SIZE)
 
         self.conversation_manager = ConversationManager(
             user_profile_manager=self.user_profile_manager,
@@ -99,49 +151,83 @@ class DiscordBot(Client):
         )
         
         self.bot_user_id_internal = os.getenv('BOT_USER_ID')
+        # discord.py IDs are ints; hot-path comparisons use this, the str form is for ConversationManager
+        self.bot_user_id_int = int(self.bot_user_id_internal) if self.bot_user_id_internal else None
         
-        self.is_processing_queue = False
-        self.last_action_timestamp = datetime.now(dt_timezone.utc)
+        # Held while a queued message or the idle task is being worked on
+        self._busy_lock = asyncio.Lock()
+        self._consumer_task = None
+        # Inbound messages waiting to be stored for context; written in batches by a background task,
+        # and flushed by the consumer before it answers so every answered message is stored first
+        self._pending_stores: list[discord.Message] = []
+        self._store_lock = asyncio.Lock()
+        self._store_task = None
+        # Resettable idle timer (loop.call_later) instead of polling
+        self._idle_handle = None
+        self._idle_task = None
+        self.last_action_timestamp = time.monotonic()
 
         dev_logger.info("DiscordBot core components initialized.")
 
     async def setup_hook(self) -> None:
-        self.loop.create_task(self.idle_time_manager_task())
-
-    async def idle_time_manager_task(self):
-        await self.wait_until_ready()
-
-        IDLE_SECONDS_THRESHOLD = 300
-        CHECK_INTERVAL = 60
-
-        while not self.is_closed():
-            await asyncio.sleep(CHECK_INTERVAL)
-
-            if self.is_processing_queue:
-                continue
-
-            time_since_last_action = (datetime.now(dt_timezone.utc) - self.last_action_timestamp).total_seconds()
+        # Tasks run synchronously until their first real await (3.12+; the image is on 3.11 for now)
+        eager_task_factory = getattr(asyncio, 'eager_task_factory', None)
+        if eager_task_factory:
+            asyncio.get_running_loop().set_task_factory(eager_task_factory)
+        self._consumer_task = self.loop.create_task(self._queue_consumer())
+
+    def _reset_idle_timer(self):
+        """(Re)arms the one-shot idle timer; called whenever Gen does something."""
+        if self._idle_handle:
+            self._idle_handle.cancel()
+        self._idle_handle = self.loop.call_later(IDLE_SECONDS_THRESHOLD, self._on_idle)
+
+    def _on_idle(self):
+        self._idle_handle = None
+        if self.is_closed(): return
+        self._idle_task = self.loop.create_task(self._run_idle_task())
+
+    async def _run_idle_task(self):
+        if self._busy_lock.locked():
+            # A message is being handled; check again after another idle period
+            # (the message itself only re-arms the timer if Gen responds to it)
+            self._reset_idle_timer()
+            return
 
-            if time_since_last_action >= IDLE_SECONDS_THRESHOLD:
-                dev_logger.info(f"Gen has been idle for {time_since_last_action:.0f} seconds. Running idle task.")
-                
-                self.is_processing_queue = True
-                try:
-                    status = await self.tinygen_controller.get_info()
-                    if status:
-                        is_active = status.get('is_processing_active', False)
-                        queued_items = status.get('queued_items', 0)
+        time_since_last_action = time.monotonic() - self.last_action_timestamp
+        dev_logger.info(f"Gen has been idle for {time_since_last_action:.0f} seconds. Running idle task.")
 
-                        if not is_active and queued_items > 0:
-                            await self.tinygen_controller.process_queue()
-                        elif not is_active:
-                            await self.tinygen_controller.resume()
-                    else:
+        try:
+            async with self._busy_lock:
+                status = await self.tinygen_controller.get_info()
+                if status:
+                    is_active = status.get('is_processing_active', False)
+                    queued_items = status.get('queued_items', 0)
+
+                    if not is_active and queued_items > 0:
+                        await self.tinygen_controller.process_queue()
+                    elif not is_active:
                         await self.tinygen_controller.resume()
-                    
-                    self.last_action_timestamp = datetime.now(dt_timezone.utc)
-                finally:
-                    self.is_processing_queue = False
+                else:
+                    await self.tinygen_controller.resume()
+
+                self.last_action_timestamp = time.monotonic()
+        except Exception as e:
+            dev_logger.error(f"Idle task failed: {e}", exc_info=True)
+        finally:
+            self._reset_idle_timer()
+
+    async def close(self):
+        if self._idle_handle:
+            self._idle_handle.cancel()
+        if self._consumer_task and not self._consumer_task.done():
+            self._consumer_task.cancel()
+        if self._store_task and not self._store_task.done():
+            self._store_task.cancel()
+        await embeddings.close_session()
+        await self.media_manager.close()
+        await self.neo4j_manager.close_async()
+        await super().close()
 
     async def on_ready(self):
         if not self.user:
@@ -158,36 +244,63 @@ class DiscordBot(Client):
         elif self.bot_user_id_internal != actual_bot_id_from_discord:
             dev_logger.error("CRITICAL MISMATCH: BOT_USER_ID in .env differs from actual bot ID. USING ACTUAL ID.")
             self.bot_user_id_internal = actual_bot_id_from_discord
+        self.bot_user_id_int = self.user.id
 
-        if self.conversation_manager:
-             self.conversation_manager.set_bot_user_id(self.bot_user_id_internal)
+        self.conversation_manager.set_bot_user_id(self.bot_user_id_internal)
 
-        if self.user_profile_manager and hasattr(self.user_profile_manager, 'set_gen_alias'):
-            try:
-                 self.user_profile_manager.set_gen_alias(
-                     bot_user_id=self.bot_user_id_internal,
-                     bot_discord_username=actual_bot_username_from_discord
-                 )
-            except Exception as e:
-                dev_logger.error(f"Error setting Gen's alias/profile in Neo4j during on_ready: {e}", exc_info=True)
+        try:
+            self.user_profile_manager.set_gen_alias(
+                bot_user_id=self.bot_user_id_internal,
+                bot_discord_username=actual_bot_username_from_discord
+            )
+        except Exception as e:
+            dev_logger.error(f"Error setting Gen's alias/profile in Neo4j during on_ready: {e}", exc_info=True)
 
-        if self.conversation_manager and hasattr(self.conversation_manager, 'set_channel_name_map'):
-            channel_id_to_name_map = {}
-            for guild in self.guilds:
-                for channel in guild.text_channels:
-                    if channel.permissions_for(guild.me).send_messages:
-                        channel_id_to_name_map[str(channel.id)] = channel.name
-            self.conversation_manager.set_channel_name_map(channel_id_to_name_map)
+        # Full scan only on (re)connect; the guild/channel events below keep the map current
+        channel_id_to_name_map = {}
+        for guild in self.guilds:
+            channel_id_to_name_map.update(self._sendable_channel_names(guild))
+        self.conversation_manager.set_channel_name_map(channel_id_to_name_map)
 
         try:
-            if hasattr(self.database_manager, 'create_everything_collection') and not self.database_manager.collection:
-                 self.database_manager.create_everything_collection()
+            if not self.database_manager.collection:
+                self.database_manager.create_everything_collection()
             dev_logger.info("'Everything' Milvus collection status checked/initialized.")
         except Exception as e:
             dev_logger.error(f"Failed to ensure Milvus 'Everything' collection readiness: {e}", exc_info=True)
 
+        self._reset_idle_timer()
         dev_logger.info("Gen is now fully ready and operational.")
 
+    @staticmethod
+    def _sendable_channel_names(guild: discord.Guild) -> dict[str, str]:
+        """{channel_id: name} for the guild's text channels Gen can send messages in."""
+        me = guild.me
+        return {str(channel.id): channel.name for channel in guild.text_channels if channel.permissions_for(me).send_messages}
+
+    def _refresh_channel_name(self, channel):
+        if not isinstance(channel, discord.TextChannel): return
+        channel_id = str(channel.id)
+        if channel.permissions_for(channel.guild.me).send_messages:
+            self.conversation_manager.update_channel_names({channel_id: channel.name})
+        else:
+            self.conversation_manager.update_channel_names({}, removed_channel_ids=(channel_id,))
+
+    async def on_guild_channel_create(self, channel):
+        self._refresh_channel_name(channel)
+
+    async def on_guild_channel_update(self, before, after):
+        self._refresh_channel_name(after)
+
+    async def on_guild_channel_delete(self, channel):
+        self.conversation_manager.update_channel_names({}, removed_channel_ids=(str(channel.id),))
+
+    async def on_guild_join(self, guild: discord.Guild):
+        self.conversation_manager.update_channel_names(self._sendable_channel_names(guild))
+
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.conversation_manager.update_channel_names({}, removed_channel_ids=[str(channel.id) for channel in guild.text_channels])
+
     async def on_member_join(self, member: discord.Member):
         if member.bot: return
         try:
@@ -196,98 +309,145 @@ class DiscordBot(Client):
             dev_logger.error(f"Error adding new member '{member.name}' to user profiles: {e}", exc_info=True)
 
     async def on_message(self, message: discord.Message):
-        if not self.user or message.author.id == self.user.id or (message.author.bot and str(message.author.id) != self.bot_user_id_internal):
-            return
-
+        if not self.user: return
+        author_id = message.author.id
+        if author_id == self.user.id: return
+        if message.author.bot and author_id != self.bot_user_id_int: return
+
+        if len(self._pending_stores) >= PENDING_STORES_MAX_SIZE:
+            # Backpressure: this event waits for the buffered batch to be written instead of growing the buffer
+            dev_logger.warning(f"Pending store buffer is full ({PENDING_STORES_MAX_SIZE}); flushing before accepting message {message.id}.")
+            await self._flush_pending_stores()
+        self._pending_stores.append(message)
+        if self._store_task is None or self._store_task.done():
+            self._store_task = asyncio.create_task(self._store_pending_messages())
+        try:
+            self.message_queue.put_nowait(message)
+            dev_logger.debug("Message %s queued. Queue size: %s", message.id, self.message_queue.qsize())
+        except asyncio.QueueFull:
+            dev_logger.warning(f"Message queue is full ({MESSAGE_QUEUE_MAX_SIZE}); message {message.id} will be stored for context but not answered.")
+
+    async def _queue_consumer(self):
+        """Long-lived worker that handles queued messages one at a time, in arrival order, until cancelled."""
+        # Loop-invariant lookups bound once for the life of the worker
+        message_queue = self.message_queue
+        get_nowait = message_queue.get_nowait
+        busy_lock = self._busy_lock
+        flush_pending_stores, handle_one, reset_idle_timer = self._flush_pending_stores, self._handle_one, self._reset_idle_timer
+        while True:
+            # Take ready messages without a loop round-trip; only suspend when the queue is empty.
+            # Messages stay queued until their turn so the conversation code still sees them as pending.
+            try:
+                message_to_process = get_nowait()
+            except asyncio.QueueEmpty:
+                message_to_process = await message_queue.get()
+            try:
+                # Everything received so far (including this message) is stored before it is answered
+                await flush_pending_stores()
+                async with busy_lock:
+                    responded = await handle_one(message_to_process)
+            except Exception as e:
+                dev_logger.error(f"Unhandled error while processing message {message_to_process.id}: {e}", exc_info=True)
+            else:
+                # Only an actual response counts as activity; ignored channel chatter must not postpone idle work
+                if responded:
+                    reset_idle_timer()
+            finally:
+                message_queue.task_done()
+
+    async def _store_pending_messages(self):
+        """Background writer: keeps flushing until no messages are waiting, independent of the consumer."""
+        while self._pending_stores:
+            await self._flush_pending_stores()
+
+    async def _flush_pending_stores(self):
+        """Stores every message received so far in one batch. Never raises; a failed batch is logged and dropped."""
+        # Serialised so a caller only returns once messages taken by an earlier flush are stored too
+        async with self._store_lock:
+            if not self._pending_stores: return
+            pending, self._pending_stores = self._pending_stores, []
+            try:
+                await self.conversation_manager.store_messages_batch(pending)
+            except Exception as e:
+                dev_logger.error(f"Failed to store {len(pending)} message(s) for context: {e}", exc_info=True)
+
+    async def _handle_one(self, message_to_process: discord.Message) -> bool:
+        """Generates and sends the response for one queued message, if it is addressed to Gen. Returns True if Gen produced a response."""
+        message_queue = self.message_queue
+        dev_logger.info("Processing message %s from queue. Remaining: %s", message_to_process.id, message_queue.qsize())
+
+        cm = self.conversation_manager
+        is_dm = isinstance(message_to_process.channel, discord.DMChannel)
+        if not is_dm:
+            # Cheapest test first; the reply check only runs when there is no mention
+            bot_user_id_int = self.bot_user_id_int
+            # raw_mentions is the int ID list parsed from the content once and cached on the message;
+            # reply pings that aren't in the content are covered by the reply check below
+            mentioned = bot_user_id_int in message_to_process.raw_mentions
+            if not mentioned:
+                reference = message_to_process.reference
+                is_reply = reference and reference.resolved and reference.resolved.author.id == bot_user_id_int
+                if not is_reply:
+                    return False
+
+        final_response_package = None
         try:
-            await self.conversation_manager.store_message_for_context(message)
-            await self.message_queue.put(message)
-            dev_logger.debug(f"Message {message.id} queued. Queue size: {self.message_queue.qsize()}")
+            async with message_to_process.channel.typing():
+                final_response_package = await cm.generate_response(message_to_process)
         except Exception as e:
-            dev_logger.error(f"Failed to store or queue message {message.id}: {e}", exc_info=True)
-            return
-
-        if self.is_processing_queue:
-            dev_logger.debug("Processor is already running. Message will be handled in turn.")
-            return
+             dev_logger.error(f"Unhandled error in generate_response for message {message_to_process.id}: {e}", exc_info=True)
+             return False
 
-        self.loop.create_task(self._process_message_queue())
-
-    async def _process_message_queue(self):
-        """Processes messages from the queue one by one until it's empty."""
-        if self.is_processing_queue:
-            return
+        if final_response_package:
+            self.last_action_timestamp = time.monotonic()
+            should_reply = not message_queue.empty()
             
-        self.is_processing_queue = True
-        dev_logger.info("Starting new message processing chain...")
-
-        try:
-            while not self.message_queue.empty():
-                message_to_process = await self.message_queue.get()
-                dev_logger.info(f"Processing message {message_to_process.id} from queue. Remaining: {self.message_queue.qsize()}")
-
-                cm = self.conversation_manager
-                is_dm = isinstance(message_to_process.channel, discord.DMChannel)
-                mentioned = self.bot_user_id_internal in [str(m.id) for m in message_to_process.mentions]
-                is_reply = message_to_process.reference and message_to_process.reference.resolved and str(message_to_process.reference.resolved.author.id) == self.bot_user_id_internal
-
-                if not (is_dm or mentioned or is_reply):
-                    continue
-
-                final_response_package = None
-                try:
-                    async with message_to_process.channel.typing():
-                        final_response_package = await cm.generate_response(message_to_process)
-                except Exception as e:
-                     dev_logger.error(f"Unhandled error in generate_response for message {message_to_process.id}: {e}", exc_info=True)
-                     continue
-
-                if final_response_package:
-                    self.last_action_timestamp = datetime.now(dt_timezone.utc)
-                    should_reply = not self.message_queue.empty()
-                    
-                    text_to_send, files_to_send = None, []
-                    if isinstance(final_response_package, tuple):
-                        text_to_send, files_to_send = final_response_package
-                    elif isinstance(final_response_package, str):
-                        text_to_send = final_response_package
-                    
-                    sent_message_object = None
-                    try:
-                        # --- FIX IS HERE ---
-                        # Explicitly use .reply() or .send() based on the should_reply flag.
-                        if text_to_send:
-                            parts = split_message(str(text_to_send))
-                            for i, part in enumerate(parts):
-                                files = files_to_send if i == len(parts) - 1 else []
-                                if should_reply and i == 0:
-                                    sent_message_object = await message_to_process.reply(content=part, files=files)
-                                else:
-                                    current_sent_msg = await message_to_process.channel.send(content=part, files=files)
-                                    if i == 0: sent_message_object = current_sent_msg
-                        elif files_to_send:
-                            if should_reply:
-                                sent_message_object = await message_to_process.reply(files=files_to_send)
-                            else:
-                                sent_message_object = await message_to_process.channel.send(files=files_to_send)
-                        # --- END OF FIX ---
-
-                        if sent_message_object:
-                            await cm.store_message_for_context(sent_message_object, existing_interaction_id=str(message_to_process.id))
-
-                    except discord.errors.Forbidden:
-                        dev_logger.warning(f"Forbidden: Cannot send/reply to channel {message_to_process.channel.id}.")
-                    except Exception as e:
-                        dev_logger.error(f"Failed to send response for message {message_to_process.id}: {e}", exc_info=True)
-        finally:
-            self.is_processing_queue = False
-            dev_logger.info("Message processing chain complete. Processor is now idle.")
+            text_to_send, files_to_send = None, []
+            if isinstance(final_response_package, tuple):
+                text_to_send, files_to_send = final_response_package
+            elif isinstance(final_response_package, str):
+                text_to_send = final_response_package
+            
+            sent_message_object = None
+            try:
+                # --- FIX IS HERE ---
+                # Explicitly use .reply() or .send() based on the should_reply flag.
+                # The reply/send choice only matters for the first part; later parts always go to the channel
+                rest_send = message_to_process.channel.send
+                first_send = message_to_process.reply if should_reply else rest_send
+                if text_to_send:
+                    text_to_send = str(text_to_send)
+                    if len(text_to_send) <= DISCORD_MESSAGE_LIMIT:
+                        # Common case: the whole response goes out in a single send
+                        sent_message_object = await first_send(content=text_to_send, files=files_to_send)
+                    else:
+                        parts = split_message(text_to_send)
+                        last_idx = len(parts) - 1
+                        sent_message_object = await first_send(content=parts[0], files=_EMPTY)
+                        for i in range(1, last_idx + 1):
+                            await rest_send(content=parts[i], files=files_to_send if i == last_idx else _EMPTY)
+                elif files_to_send:
+                    sent_message_object = await first_send(files=files_to_send)
+                # --- END OF FIX ---
+
+                if sent_message_object:
+                    await cm.store_message_for_context(sent_message_object, existing_interaction_id=str(message_to_process.id))
+
+            except discord.errors.Forbidden:
+                dev_logger.warning(f"Forbidden: Cannot send/reply to channel {message_to_process.channel.id}.")
+            except Exception as e:
+                dev_logger.error(f"Failed to send response for message {message_to_process.id}: {e}", exc_info=True)
+            return True
+        return False
 
 async def run_bot_async():
     dotenv_path = Path('.') / '.env'
-    if dotenv_path.exists():
+    dotenv_found = dotenv_path.exists()
+    if dotenv_found:
         load_dotenv(dotenv_path=dotenv_path)
-    else:
+    # After .env is loaded, so LOG_LEVEL and TIMEZONE from it take effect
+    _bootstrap()
+    if not dotenv_found:
         dev_logger.warning(".env file not found. Relying on externally set environment variables.")
 
     bot_token = os.getenv('DISCORD_TOKEN')
@@ -311,4 +471,6 @@ async def run_bot_async():
         dev_logger.info("Bot has been shut down or failed to start.")
 
 if __name__ == "__main__":
-    asyncio.run(run_bot_async())
+    # libuv-backed loop for the gateway/HTTP socket traffic; asyncio.run() only takes a loop_factory on 3.12+
+    with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+        runner.run(run_bot_async())
@@ -6,15 +6,105 @@ import aiohttp
 import base64
 import io
 import asyncio
+import time
 from io import BytesIO
 import discord
 from PIL import Image
 from pathlib import Path
-import json
+import orjson
+import re
+import uuid
+import hashlib
+from collections import OrderedDict
 
 thought_logger = logging.getLogger('thought')
 dev_logger = logging.getLogger('dev')
 
+# Upper bound on simultaneous /view downloads so a large batch does not swamp ComfyUI
+COMFY_DOWNLOAD_CONCURRENCY = 8
+
+# PIL format -> data URL subtype for vision payloads; anything else is labelled jpeg
+VISION_MIME_TYPES = {'JPEG': 'jpeg', 'PNG': 'png', 'GIF': 'gif'}
+
+WORKFLOW_CACHE_MAX_SIZE = 32
+VISION_CACHE_MAX_SIZE = 256
+
+# (prompt keyword, env var naming the workflow to use); the first keyword found in the prompt wins
+WORKFLOW_KEYWORD_ROUTES = (('anime', 'WFLOW_IL'),)
+_WORD_PATTERN = re.compile(r'\w+')
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# After asking LocalAI to unload, ComfyUI's reported free VRAM is polled for at most VRAM_WAIT_SECONDS
+VRAM_WAIT_SECONDS = 10
+VRAM_POLL_INTERVAL_SECONDS = 0.25
+VRAM_OVERHEAD_FACTOR = 64  # Rough multiplier from output pixel bytes to sampling working memory
+
+async def _read_to_buffer(resp) -> BytesIO:
+    """Streams a response body into a rewound BytesIO without an intermediate bytes copy."""
+    buf = BytesIO()
+    async for chunk in resp.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+        buf.write(chunk)
+    buf.seek(0)
+    return buf
+
+class RateController:
+    """
+    AIMD concurrency limiter for the image backends.
+
+    Allowed concurrency is halved on 429/5xx responses and timeouts, and grows by 0.5 after each success
+    that finished within target_latency, up to max_concurrency. A Retry-After header holds back new
+    requests and retries until it expires.
+    """
+    def __init__(self, max_concurrency: int, target_latency: float):
+        self.max_concurrency = max(1, max_concurrency)
+        self.current_concurrency = float(self.max_concurrency)
+        self.target_latency = target_latency
+        self._in_flight = 0
+        self._retry_at = 0.0
+        self._cond = asyncio.Condition()
+
+    async def __aenter__(self):
+        # Retry-After is slept out before a slot is taken, so a caller cancelled while waiting never holds one
+        while True:
+            delay = self._retry_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            async with self._cond:
+                await self._cond.wait_for(lambda: self._in_flight < int(self.current_concurrency))
+                # Another response may have pushed Retry-After out while this caller waited for a slot
+                if self._retry_at <= time.monotonic():
+                    self._in_flight += 1
+                    return self
+
+    async def __aexit__(self, *exc_info):
+        async with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    async def wait(self, default_delay: float):
+        """Sleeps before a retry: until Retry-After expires if the server sent one, otherwise default_delay."""
+        delay = self._retry_at - time.monotonic()
+        await asyncio.sleep(delay if delay > 0 else default_delay)
+
+    def observe(self, status: int, headers, elapsed: float):
+        """Adjusts the concurrency limit from a backend response."""
+        if status == 429 or status >= 500:
+            self.throttle(headers.get('Retry-After'))
+        elif 200 <= status < 300 and elapsed <= self.target_latency:
+            self.current_concurrency = min(self.max_concurrency, self.current_concurrency + 0.5)
+
+    def throttle(self, retry_after=None):
+        """Multiplicative decrease; retry_after is the raw Retry-After value in seconds, if any."""
+        self.current_concurrency = max(1.0, self.current_concurrency * 0.5)
+        try:
+            retry_after = float(retry_after) if retry_after else 0.0
+        except ValueError:
+            retry_after = 0.0  # HTTP-date form is not used by LocalAI/ComfyUI
+        if retry_after > 0:
+            self._retry_at = max(self._retry_at, time.monotonic() + retry_after)
+        dev_logger.warning(f"Image backend throttled; concurrency limit now {int(self.current_concurrency)}, retry after {retry_after:.1f}s")
+
 class MediaManager:
     def __init__(self):
         self.localai_url = os.getenv('LOCALAI_URL', 'http://10.0.1.101:9090')
@@ -28,41 +118,149 @@ class MediaManager:
         self.image_steps = int(os.getenv('IMAGE_STEPS', '40'))
         self.image_cfg_scale = float(os.getenv('IMAGE_CFG_SCALE', '6.5'))
         self.timeout_seconds = 60
+        self.min_free_vram_bytes = int(os.getenv('COMFY_MIN_FREE_VRAM_MB', '6144')) * 1024 * 1024
+        self._session: aiohttp.ClientSession | None = None
+        self._download_sem = asyncio.Semaphore(COMFY_DOWNLOAD_CONCURRENCY)
+        # path -> (st_mtime_ns, parsed JSON); entries are shared, never mutate them
+        self._workflow_cache: OrderedDict[str, tuple[int, dict]] = OrderedDict()
+        # Keyed by image digest + prompt so reposted images are described once
+        self._vision_lru: OrderedDict[str, str] = OrderedDict()
+        self._vision_inflight: dict[str, asyncio.Future] = {}
+        self._workflow_routes = [(keyword, os.environ[var]) for keyword, var in WORKFLOW_KEYWORD_ROUTES if os.environ.get(var)]
+        # Caps on in-flight GPU work; callers beyond the limit queue here instead of overloading the backend
+        self._gen_limiter = RateController(
+            int(os.getenv('MEDIA_MAX_CONCURRENCY', '2')),
+            float(os.getenv('MEDIA_TARGET_LATENCY_SECONDS', '30'))
+        )
+        self._vision_sem = asyncio.Semaphore(int(os.getenv('VISION_MAX_CONCURRENCY', '4')))
         dev_logger.debug(f"Loaded IMAGE_SIZE={self.image_size}, IMAGE_N={self.image_n} from .env")
 
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Returns the shared keep-alive session, creating it on first use."""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=100, limit_per_host=16, keepalive_timeout=75, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=self.timeout_seconds)
+            )
+        return self._session
+
+    async def close(self):
+        """Closes the shared session. Called on bot shutdown."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _load_json_cached(self, path: Path) -> dict:
+        """Parses a JSON file, reusing the cached parse while its mtime is unchanged. Blocking; run via to_thread."""
+        key = str(path)
+        mtime = path.stat().st_mtime_ns
+        cached = self._workflow_cache.get(key)
+        if cached and cached[0] == mtime:
+            self._workflow_cache.move_to_end(key)
+            return cached[1]
+        data = orjson.loads(path.read_bytes())
+        self._workflow_cache[key] = (mtime, data)
+        self._workflow_cache.move_to_end(key)
+        if len(self._workflow_cache) > WORKFLOW_CACHE_MAX_SIZE:
+            self._workflow_cache.popitem(last=False)
+        return data
+
+    async def _wait_for_free_vram(self, session, required_bytes):
+        """
+        Polls ComfyUI /system_stats until the first device reports required_bytes free, for up to VRAM_WAIT_SECONDS.
+        If the probe itself fails, sleeps out the rest of that window as the old fixed wait did.
+        """
+        deadline = time.monotonic() + VRAM_WAIT_SECONDS
+        try:
+            async with asyncio.timeout(VRAM_WAIT_SECONDS):
+                while True:
+                    async with session.get(self.comfy_url + '/system_stats') as resp:
+                        resp.raise_for_status()
+                        stats = await resp.json(loads=orjson.loads)
+                    vram_free = stats['devices'][0]['vram_free']
+                    if vram_free >= required_bytes:
+                        dev_logger.debug(f"ComfyUI reports {vram_free // (1024 * 1024)} MB VRAM free, continuing.")
+                        return
+                    await asyncio.sleep(VRAM_POLL_INTERVAL_SECONDS)
+        except TimeoutError:
+            dev_logger.debug(f"VRAM did not reach {required_bytes // (1024 * 1024)} MB free within {VRAM_WAIT_SECONDS}s, continuing anyway.")
+        except Exception as e:
+            dev_logger.debug(f"ComfyUI /system_stats probe failed ({e}), falling back to a fixed wait.")
+            remaining = deadline - time.monotonic()
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+
+    async def _wait_for_comfyui_completion(self, ws, prompt_id):
+        """Waits on the ComfyUI websocket until prompt_id finishes. Returns False if execution failed."""
+        async for msg in ws:
+            if msg.type == aiohttp.WSMsgType.ERROR:
+                break
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                continue  # Binary frames are latent previews
+            event = orjson.loads(msg.data)
+            data = event.get('data') or {}
+            if data.get('prompt_id') != prompt_id:
+                continue
+            event_type = event.get('type')
+            if event_type == 'execution_error':
+                dev_logger.error(f"ComfyUI generation failed: {data.get('exception_message', 'No details')}")
+                return False
+            # ComfyUI signals the end of a prompt with an 'executing' event whose node is None
+            if event_type == 'execution_success' or (event_type == 'executing' and data.get('node') is None):
+                return True
+        raise ConnectionError("ComfyUI websocket closed before the prompt finished")
+
+    async def _fetch_view(self, session, filename, subfolder, idx):
+        """Downloads one ComfyUI output image. Returns a discord.File, or None on failure."""
+        params = {'filename': filename, 'type': 'output', 'subfolder': subfolder}
+        async with self._download_sem:
+            async with session.get(self.comfy_url + '/view', params=params) as img_resp:
+                if img_resp.status != 200:
+                    dev_logger.error(f"Failed to download image {filename}: {img_resp.status}")
+                    return None
+                buf = await _read_to_buffer(img_resp)
+        return discord.File(fp=buf, filename=f"gen_image_{idx}.png")
+
     async def generate_image_from_comfyui(self, prompt, image_n=None, image_size=None):
         """Generate images using ComfyUI and return Discord-ready files."""
+        async with self._gen_limiter:
+            return await self._generate_image_from_comfyui(prompt, image_n, image_size)
+
+    async def _generate_image_from_comfyui(self, prompt, image_n, image_size):
         image_n = image_n if image_n is not None else self.image_n
         image_size = image_size if image_size is not None else self.image_size
         headers = {"Content-Type": "application/json"}
         if self.localai_api_key:
             headers["Authorization"] = f"Bearer {self.localai_api_key}"
+        width, height = map(int, image_size.split('x'))
+        if width > self.max_image_size or height > self.max_image_size:
+            width = min(width, self.max_image_size)
+            height = min(height, self.max_image_size)
 
         try:
-            async with aiohttp.ClientSession() as session:
-                payload = {
-                    "model": "nomodel",
-                    "messages": [{"role": "user", "content": "Say this is a test!"}]
-                }
-                dev_logger.debug("Attempting to free VRAM by calling LocalAI with 'nomodel'")
-                async with session.post(self.localai_url + '/v1/chat/completions', json=payload, headers=headers) as resp:
-                    dev_logger.debug(f"LocalAI nomodel call response status: {resp.status}")
-                    thought_logger.info("Waiting 10 seconds for VRAM to free after nomodel call...")
-                    await asyncio.sleep(10)
+            session = await self._get_session()
+            payload = {
+                "model": "nomodel",
+                "messages": [{"role": "user", "content": "Say this is a test!"}]
+            }
+            dev_logger.debug("Attempting to free VRAM by calling LocalAI with 'nomodel'")
+            async with session.post(self.localai_url + '/v1/chat/completions', data=orjson.dumps(payload), headers=headers) as resp:
+                dev_logger.debug(f"LocalAI nomodel call response status: {resp.status}")
+            thought_logger.info("Waiting for VRAM to free after nomodel call...")
+            required_bytes = max(self.min_free_vram_bytes, width * height * 4 * image_n * VRAM_OVERHEAD_FACTOR)
+            await self._wait_for_free_vram(session, required_bytes)
         except Exception as e:
             dev_logger.debug(f"Non-critical error during nomodel call: {e}")
             pass
 
         # Determine which workflow to use based on the prompt content.
         workflow_filename = os.environ.get('WFLOW') # Default workflow
-        if 'anime' in prompt.lower():
-            dev_logger.info("'anime' keyword detected in prompt, checking for alternate workflow.")
-            anime_workflow = os.environ.get('WFLOW_IL')
-            if anime_workflow:
-                workflow_filename = anime_workflow
-                dev_logger.info(f"Using anime-specific workflow: {workflow_filename}")
-            else:
-                dev_logger.info("WFLOW_IL not defined, falling back to default workflow.")
+        if self._workflow_routes:
+            tokens = set(_WORD_PATTERN.findall(prompt.casefold()))
+            routed = next(((keyword, workflow) for keyword, workflow in self._workflow_routes if keyword in tokens), None)
+            if routed:
+                workflow_filename = routed[1]
+                dev_logger.info(f"'{routed[0]}' keyword detected in prompt, using workflow: {workflow_filename}")
 
         if not workflow_filename:
             dev_logger.error("No workflow filename could be determined. WFLOW environment variable is not set.")
@@ -77,10 +275,8 @@ class MediaManager:
             dev_logger.info(f"Loading workflow: {workflow_path}")
             dev_logger.info(f"Loading config: {config_path}")
 
-            with open(workflow_path, 'r', encoding='utf-8') as f:
-                workflow = json.load(f)
-            with open(config_path, 'r', encoding='utf-8') as f:
-                config = json.load(f)
+            workflow = await asyncio.to_thread(self._load_json_cached, workflow_path)
+            config = await asyncio.to_thread(self._load_json_cached, config_path)
         except FileNotFoundError as e:
             dev_logger.error(f"Could not find workflow or config file: {e}")
             return []
@@ -88,13 +284,12 @@ class MediaManager:
             dev_logger.error(f"Failed to load workflow or config file: {e}")
             return []
 
-        width, height = map(int, image_size.split('x'))
-        if width > self.max_image_size or height > self.max_image_size:
-            width = min(width, self.max_image_size)
-            height = min(height, self.max_image_size)
-            
         # Update workflow with prompt, size, and batch details from config
         try:
+            # The parsed workflow is cached, so copy only the nodes edited below
+            workflow = dict(workflow)
+            for node_id in {config['prompt_node'], config['size_node']}:
+                workflow[node_id] = {**workflow[node_id], 'inputs': dict(workflow[node_id]['inputs'])}
             workflow[config['prompt_node']]['inputs'][config['prompt_key']] = prompt
             workflow[config['size_node']]['inputs'][config['width_key']] = width
             workflow[config['size_node']]['inputs'][config['height_key']] = height
@@ -103,75 +298,104 @@ class MediaManager:
             dev_logger.error(f"KeyError when configuring workflow. Check your config file '{config_filename}'. Missing key: {e}")
             return []
 
+        ws = None
         try:
-            async with aiohttp.ClientSession() as session:
-                prompt_id = None
-                retries = 3
-                headers = {"Content-Type": "application/json"}
-                for attempt in range(retries):
-                    try:
-                        async with session.post(self.comfy_url + '/prompt', json={"prompt": workflow}, headers=headers) as resp:
-                            if resp.status != 200:
-                                response_text = await resp.text()
-                                dev_logger.error(f"ComfyUI prompt queuing failed (attempt {attempt + 1}/{retries}): {resp.status} - {response_text}")
-                                if attempt == retries - 1:
-                                    return []
-                                await asyncio.sleep(2)
-                                continue
-                            data = await resp.json()
-                            prompt_id = data['prompt_id']
-                            thought_logger.info(f"ComfyUI prompt queued with ID: {prompt_id}")
-                            break
-                    except Exception as e:
-                        dev_logger.error(f"ComfyUI prompt queuing error (attempt {attempt + 1}/{retries}): {e}")
-                        if attempt == retries - 1:
-                            return []
-                        await asyncio.sleep(2)
-                if not prompt_id:
-                    dev_logger.error("Failed to queue prompt after all retries")
-                    return []
-
-                while True:
-                    async with session.get(self.comfy_url + '/history/' + prompt_id) as resp:
+            session = await self._get_session()
+            # Completion is pushed over the websocket; history polling remains as the fallback
+            client_id = uuid.uuid4().hex
+            try:
+                ws = await session.ws_connect(self.comfy_url.replace('http', 'ws', 1) + '/ws', params={'clientId': client_id})
+            except Exception as e:
+                dev_logger.warning(f"ComfyUI websocket unavailable, falling back to history polling: {e}")
+            prompt_id = None
+            retries = 3
+            headers = {"Content-Type": "application/json"}
+            for attempt in range(retries):
+                try:
+                    async with session.post(self.comfy_url + '/prompt', data=orjson.dumps({"prompt": workflow, "client_id": client_id}), headers=headers) as resp:
                         if resp.status != 200:
-                            dev_logger.debug(f"Polling attempt failed for prompt ID {prompt_id}: {resp.status}")
-                            await asyncio.sleep(1)
-                            continue
-                        history = await resp.json()
-                        if prompt_id in history:
-                            # Check for completion status
-                            if history[prompt_id].get('status', {}).get('completed') and 'outputs' in history[prompt_id]:
-                                break # Success
-                            # Check for errors during execution
-                            if not history[prompt_id].get('status', {}).get('completed'):
-                                if 'messages' in history[prompt_id].get('status', {}):
-                                    for msg in history[prompt_id]['status']['messages']:
-                                        if msg[0] == 'execution_error':
-                                            dev_logger.error(f"ComfyUI generation failed: {msg[1].get('exception_message', 'No details')}")
-                                            return []
-                            await asyncio.sleep(1)
+                            # Queueing returns at once, so only failures are observed here; latency is observed on completion
+                            self._gen_limiter.observe(resp.status, resp.headers, 0.0)
+                            response_text = await resp.text()
+                            dev_logger.error(f"ComfyUI prompt queuing failed (attempt {attempt + 1}/{retries}): {resp.status} - {response_text}")
+                            if attempt == retries - 1:
+                                return []
+                            await self._gen_limiter.wait(2)
                             continue
-                    await asyncio.sleep(1)
+                        data = await resp.json(loads=orjson.loads)
+                        prompt_id = data['prompt_id']
+                        queued_at = time.monotonic()
+                        thought_logger.info(f"ComfyUI prompt queued with ID: {prompt_id}")
+                        break
+                except Exception as e:
+                    dev_logger.error(f"ComfyUI prompt queuing error (attempt {attempt + 1}/{retries}): {e}")
+                    self._gen_limiter.throttle()
+                    if attempt == retries - 1:
+                        return []
+                    await self._gen_limiter.wait(2)
+            if not prompt_id:
+                dev_logger.error("Failed to queue prompt after all retries")
+                return []
+
+            if ws is not None:
+                try:
+                    if not await asyncio.wait_for(self._wait_for_comfyui_completion(ws, prompt_id), timeout=self.timeout_seconds):
+                        return []
+                except Exception as e:
+                    dev_logger.warning(f"ComfyUI websocket wait failed for prompt ID {prompt_id}, falling back to history polling: {e!r}")
+
+            # Once the websocket reports completion this loop fetches the history a single time
+            while True:
+                async with session.get(self.comfy_url + '/history/' + prompt_id) as resp:
+                    if resp.status != 200:
+                        dev_logger.debug(f"Polling attempt failed for prompt ID {prompt_id}: {resp.status}")
+                        await asyncio.sleep(1)
+                        continue
+                    history = await resp.json(loads=orjson.loads)
+                    if prompt_id in history:
+                        # Check for completion status
+                        if history[prompt_id].get('status', {}).get('completed') and 'outputs' in history[prompt_id]:
+                            break # Success
+                        # Check for errors during execution
+                        if not history[prompt_id].get('status', {}).get('completed'):
+                            if 'messages' in history[prompt_id].get('status', {}):
+                                for msg in history[prompt_id]['status']['messages']:
+                                    if msg[0] == 'execution_error':
+                                        dev_logger.error(f"ComfyUI generation failed: {msg[1].get('exception_message', 'No details')}")
+                                        return []
+                        await asyncio.sleep(1)
+                        continue
+                await asyncio.sleep(1)
+            self._gen_limiter.observe(200, {}, time.monotonic() - queued_at)
 
-                files = []
-                for node_id, node_output in history[prompt_id]['outputs'].items():
-                    if 'images' in node_output:
-                        for idx, image in enumerate(node_output['images']):
-                            filename = image['filename']
-                            subfolder = image.get('subfolder', '')
-                            params = {'filename': filename, 'type': 'output', 'subfolder': subfolder}
-                            async with session.get(self.comfy_url + '/view', params=params) as img_resp:
-                                if img_resp.status != 200:
-                                    dev_logger.error(f"Failed to download image {filename}: {img_resp.status}")
-                                    continue
-                                img_data = await img_resp.read()
-                                file = discord.File(fp=BytesIO(img_data), filename=f"gen_image_{idx}.png")
-                                files.append(file)
-                thought_logger.info(f"Generated {len(files)} images via ComfyUI")
-                return files
+            items = [
+                (image['filename'], image.get('subfolder', ''), idx)
+                for node_output in history[prompt_id]['outputs'].values()
+                for idx, image in enumerate(node_output.get('images', ()))
+            ]
+            results = await asyncio.gather(*[self._fetch_view(session, f, sf, idx) for f, sf, idx in items], return_exceptions=True)
+            files = []
+            for (filename, _, _), result in zip(items, results):
+                if isinstance(result, BaseException):
+                    dev_logger.error(f"Failed to download image {filename}: {result}")
+                elif result is not None:
+                    files.append(result)
+            thought_logger.info(f"Generated {len(files)} images via ComfyUI")
+            return files
         except Exception as e:
             dev_logger.error(f"ComfyUI image generation error: {e}", exc_info=True)
             return []
+        finally:
+            if ws is not None:
+                await ws.close()
+
+    async def _download_image(self, session, image_url, headers):
+        """Downloads a generated image by URL. Returns a rewound BytesIO, or None on failure."""
+        async with session.get(image_url, headers=headers) as img_resp:
+            if img_resp.status != 200:
+                dev_logger.error(f"Image download failed from {image_url}: {img_resp.status}")
+                return None
+            return await _read_to_buffer(img_resp)
 
     async def generate_image_from_localai(self, prompt, neg_prompt=None, image_n=None, image_size=None):
         """Generate images using Stable Diffusion or ComfyUI and return Discord-ready files."""
@@ -179,7 +403,10 @@ class MediaManager:
         image_size = image_size if image_size is not None else self.image_size
         if self.comfy_url:
             return await self.generate_image_from_comfyui(prompt, image_n, image_size)
+        async with self._gen_limiter:
+            return await self._generate_image_from_sd(prompt, neg_prompt, image_n, image_size)
 
+    async def _generate_image_from_sd(self, prompt, neg_prompt, image_n, image_size):
         url = f"{self.localai_url}/v1/images/generations"
         headers = {"Content-Type": "application/json"}
         if self.localai_api_key:
@@ -200,37 +427,38 @@ class MediaManager:
         thought_logger.info(f"Gen is generating an image with prompt: '{prompt}'")
         dev_logger.debug(f"Image generation payload: {payload}")
         retries = 3
+        session = await self._get_session()
         for attempt in range(retries):
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with asyncio.timeout(self.timeout_seconds):
-                        async with session.post(url, json=payload, headers=headers) as resp:
-                            if resp.status == 200:
-                                data = await resp.json()
-                                images = []
-                                async with aiohttp.ClientSession() as download_session:
-                                    for img_data in data.get("data", []):
-                                        if "url" in img_data:
-                                            image_url = img_data["url"]
-                                            async with download_session.get(image_url, headers=headers) as img_resp:
-                                                if img_resp.status == 200:
-                                                    img_bytes = await img_resp.read()
-                                                    images.append(discord.File(BytesIO(img_bytes), f"gen_image_{len(images)}.png"))
-                                                else:
-                                                    dev_logger.error(f"Image download failed from {image_url}: {img_resp.status}")
-                                        elif "b64_json" in img_data:
-                                            img_bytes = base64.b64decode(img_data["b64_json"])
-                                            images.append(discord.File(BytesIO(img_bytes), f"gen_image_{len(images)}.png"))
-                                thought_logger.info(f"Generated {len(images)} images")
-                                return images
-                            else:
-                                dev_logger.error(f"Image generation failed (attempt {attempt + 1}/{retries}): {resp.status}")
+                async with asyncio.timeout(self.timeout_seconds):
+                    started = time.monotonic()
+                    async with session.post(url, data=orjson.dumps(payload), headers=headers) as resp:
+                        self._gen_limiter.observe(resp.status, resp.headers, time.monotonic() - started)
+                        if resp.status == 200:
+                            data = await resp.json(loads=orjson.loads)
+                            entries = [img_data for img_data in data.get("data", []) if "url" in img_data or "b64_json" in img_data]
+                            # URL entries are fetched concurrently; b64 entries are decoded in place, keeping the response order
+                            downloads = await asyncio.gather(*[
+                                self._download_image(session, img_data["url"], headers)
+                                for img_data in entries if "url" in img_data
+                            ])
+                            downloaded = iter(downloads)
+                            images = []
+                            for img_data in entries:
+                                buf = next(downloaded) if "url" in img_data else BytesIO(base64.b64decode(img_data["b64_json"]))
+                                if buf is not None:
+                                    images.append(discord.File(buf, f"gen_image_{len(images)}.png"))
+                            thought_logger.info(f"Generated {len(images)} images")
+                            return images
+                        else:
+                            dev_logger.error(f"Image generation failed (attempt {attempt + 1}/{retries}): {resp.status}")
             except asyncio.TimeoutError:
                 dev_logger.error(f"Image generation timed out (attempt {attempt + 1}/{retries})")
+                self._gen_limiter.throttle()
             except Exception as e:
                 dev_logger.error(f"Image generation error (attempt {attempt + 1}/{retries}): {e}")
             if attempt < retries - 1:
-                await asyncio.sleep(1)
+                await self._gen_limiter.wait(1)
         return []
 
     async def analyze_image(self, image_data: bytes, prompt: str) -> str:
@@ -238,23 +466,58 @@ class MediaManager:
         if not self.vl_model:
             thought_logger.warning("VL_MODEL is not set. Vision functionality disabled.")
             return ""
+        key = hashlib.blake2b(image_data, digest_size=16).hexdigest() + ':' + prompt
+        cached = self._vision_lru.get(key)
+        if cached is not None:
+            self._vision_lru.move_to_end(key)
+            dev_logger.debug("Image analysis served from cache.")
+            return cached
+        inflight = self._vision_inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._vision_inflight[key] = future
         try:
-            image = Image.open(io.BytesIO(image_data))
-            width, height = image.size
-            if max(width, height) > self.max_image_size:
-                if width > height:
-                    new_width = self.max_image_size
-                    new_height = int(height * (self.max_image_size / width))
-                else:
-                    new_height = self.max_image_size
-                    new_width = int(width * (self.max_image_size / height))
-                image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            format = image.format or 'JPEG'
+            async with self._vision_sem:
+                description = await self._analyze_image(image_data, prompt)
+            future.set_result(description)
+            # Failures come back as "" and are not cached, so the next request retries
+            if description:
+                self._vision_lru[key] = description
+                if len(self._vision_lru) > VISION_CACHE_MAX_SIZE:
+                    self._vision_lru.popitem(last=False)
+            return description
+        finally:
+            del self._vision_inflight[key]
+            if not future.done():
+                future.set_result("")
+
+    def _prepare_vision_payload(self, image_data: bytes) -> tuple[str, str]:
+        """Downscales the image if needed and returns (base64 data, mime subtype). CPU-bound; run via to_thread."""
+        # Image.open only parses the header; pixels are decoded on demand
+        image = Image.open(io.BytesIO(image_data))
+        format = image.format or 'JPEG'
+        if max(image.size) <= self.max_image_size and format in VISION_MIME_TYPES:
+            # Already small enough and in a format the model accepts: send the upload as-is
+            resized_image_data = image_data
+        else:
+            max_size = (self.max_image_size, self.max_image_size)
+            if format == 'JPEG':
+                # Let libjpeg DCT-downscale while decoding instead of decoding the full pixel plane
+                image.draft('RGB', max_size)
+            # In place and keeps image.format; no-op when the image already fits
+            image.thumbnail(max_size, Image.Resampling.LANCZOS, reducing_gap=2.0)
             with io.BytesIO() as output:
                 image.save(output, format=format)
                 resized_image_data = output.getvalue()
-            base64_image = base64.b64encode(resized_image_data).decode('utf-8')
-            mime_type = 'jpeg' if format == 'JPEG' else 'png' if format == 'PNG' else 'gif' if format == 'GIF' else 'jpeg'
+        base64_image = base64.b64encode(resized_image_data).decode('utf-8')
+        mime_type = VISION_MIME_TYPES.get(format, 'jpeg')
+        return base64_image, mime_type
+
+    async def _analyze_image(self, image_data: bytes, prompt: str) -> str:
+        try:
+            base64_image, mime_type = await asyncio.to_thread(self._prepare_vision_payload, image_data)
 
             messages = [
                 {"role": "system", "content": "You are a helpful assistant with vision capabilities."},
@@ -274,19 +537,19 @@ class MediaManager:
             thought_logger.info("Gen is analyzing an image")
             dev_logger.debug(f"Analyzing image.")
             retries = 3
+            session = await self._get_session()
             for attempt in range(retries):
                 try:
-                    async with aiohttp.ClientSession() as session:
-                        async with asyncio.timeout(self.timeout_seconds):
-                            async with session.post(url, headers=headers, json=data) as resp:
-                                if resp.status == 200:
-                                    result = await resp.json()
-                                    description = result['choices'][0]['message']['content']
-                                    thought_logger.info(f"Image analyzed: '{description}'")
-                                    dev_logger.debug(f"Image analysis result: {description}")
-                                    return description
-                                else:
-                                    dev_logger.error(f"Image analysis failed (attempt {attempt + 1}/{retries}): {resp.status}")
+                    async with asyncio.timeout(self.timeout_seconds):
+                        async with session.post(url, headers=headers, data=orjson.dumps(data)) as resp:
+                            if resp.status == 200:
+                                result = await resp.json(loads=orjson.loads)
+                                description = result['choices'][0]['message']['content']
+                                thought_logger.info(f"Image analyzed: '{description}'")
+                                dev_logger.debug(f"Image analysis result: {description}")
+                                return description
+                            else:
+                                dev_logger.error(f"Image analysis failed (attempt {attempt + 1}/{retries}): {resp.status}")
                 except asyncio.TimeoutError:
                     dev_logger.error(f"Image analysis timed out (attempt {attempt + 1}/{retries})")
                 except Exception as e:
@@ -0,0 +1,42 @@
+# message_queue.py
+
+import asyncio
+from collections import defaultdict, deque
+
+import discord
+
+_EMPTY_BUCKET = ()
+
+class ChannelPartitionedQueue(asyncio.Queue):
+    """
+    FIFO queue of Discord messages that also keeps a per-channel index.
+    Ordering and blocking semantics are exactly those of asyncio.Queue; the
+    per-channel buckets let callers peek at one channel's pending messages
+    without scanning the whole queue, and `ids` answers "is this message
+    still pending?" in O(1).
+    """
+
+    def _init(self, maxsize):
+        super()._init(maxsize)
+        self._by_channel: dict[str, deque] = defaultdict(deque)
+        self.ids: set[str] = set()
+
+    def _put(self, item: discord.Message):
+        super()._put(item)
+        self._by_channel[str(item.channel.id)].append(item)
+        self.ids.add(str(item.id))
+
+    def _get(self) -> discord.Message:
+        item = super()._get()
+        self.ids.discard(str(item.id))
+        channel_id = str(item.channel.id)
+        # The globally oldest message is also the oldest one in its own channel
+        bucket = self._by_channel[channel_id]
+        bucket.popleft()
+        if not bucket:
+            del self._by_channel[channel_id]
+        return item
+
+    def messages_in_channel(self, channel_id: str):
+        """Returns the pending messages for one channel in arrival order. Do not mutate."""
+        return self._by_channel.get(channel_id, _EMPTY_BUCKET)
@@ -6,7 +6,8 @@ import json
 import asyncio
 import aiohttp
 import re
-from pathlib import Path
+from datetime import datetime
+from zoneinfo import ZoneInfo
 
 from media_manager import MediaManager
 from web_search import WebSearchManager
@@ -14,19 +15,22 @@ from user_profiles import UserProfileManager
 import capabilities
 
 from tinygen_controller import TinyGenController
-
-import sentencepiece as spm
+from tokenizer_provider import TokenizerProvider, get_tokenizer_provider
 
 thought_logger = logging.getLogger('thought')
 dev_logger = logging.getLogger('dev')
 
 FALLBACK_PROMPT_OVERHEAD_TOKENS = 2000
+CURRENT_TIME_PLACEHOLDER = "{current_time}"
+CURRENT_TIME_FORMAT = "%A, %B %d, %Y, %H:%M %Z"
+MENTION_RE = re.compile(r'<@!?(\d+)>')
 
 class ThoughtProcessor:
     def __init__(self,
                  media_manager: MediaManager,
                  web_search_manager: WebSearchManager,
-                 user_profile_manager: UserProfileManager):
+                 user_profile_manager: UserProfileManager,
+                 tokenizer_provider: TokenizerProvider = None):
 
         self.tinygen_controller = TinyGenController()
 
@@ -39,25 +43,23 @@ class ThoughtProcessor:
         self.model_name = os.getenv('MODEL_NAME', 'gpt-4')
         self.timeout_seconds = int(os.getenv('LOCALAI_TIMEOUT_SECONDS', 120))
         self.llm_temperature = float(os.getenv('LLM_TEMPERATURE', '0.7'))
+        self.timezone = ZoneInfo(os.getenv('TIMEZONE', 'UTC'))
         
         self.gen_name = "Gen"
         self.main_system_prompt_base = ""
         self.bot_user_id = None
 
         self.tool_schemas = capabilities.get_tool_schemas()
+        self.tool_summaries_str = "Available tools: " + " ".join(
+            f"[{t['name']}] {t['summary']}" for t in capabilities.get_tool_summaries()
+        )
         dev_logger.debug(f"ThoughtProcessor initialized with {len(self.tool_schemas)} tool schemas from capabilities.")
 
-        self.tokenizer = None
-        try:
-            tokenizer_model_path = Path(os.getenv('TOKENIZER_MODEL_PATH', 'models/tokenizer.model'))
-            if tokenizer_model_path.exists():
-                self.tokenizer = spm.SentencePieceProcessor()
-                self.tokenizer.load(str(tokenizer_model_path))
-            else:
-                dev_logger.warning(f"Tokenizer model not found at '{tokenizer_model_path}'.")
-        except Exception as e:
-            dev_logger.error(f"Failed to load SentencePiece tokenizer: {e}.")
-            self.tokenizer = None
+        self.tokenizer_provider = tokenizer_provider or get_tokenizer_provider()
+
+    @property
+    def tokenizer(self):
+        return self.tokenizer_provider.tokenizer
 
     def set_bot_user_id(self, bot_user_id: str):
         self.bot_user_id = str(bot_user_id)
@@ -104,7 +106,7 @@ class ThoughtProcessor:
             if attempt < 2: await asyncio.sleep(1)
         return {"error": "LocalAI call failed after all retries."}
 
-    async def get_next_decision(self, base_history: list, current_interaction_turns: list, user_message: dict, long_term_history_str: str, message_queue_str: str, persona_data: dict, max_tokens: int):
+    async def get_next_decision(self, base_history: list, current_interaction_turns: list, user_message: dict, long_term_history_str: str, message_queue_str: str, persona_data: dict, max_tokens: int, tools: list = None):
         messages = []
         
         # 1. Long-Term Memory
@@ -120,7 +122,13 @@ class ThoughtProcessor:
 
         # 4. System Prompt
         system_prompt = f"{self.main_system_prompt_base} {persona_data.get('details_for_prompt', '')}"
+        if CURRENT_TIME_PLACEHOLDER in system_prompt:
+            system_prompt = system_prompt.replace(CURRENT_TIME_PLACEHOLDER, datetime.now(self.timezone).strftime(CURRENT_TIME_FORMAT))
         
+        # Only a subset of full schemas is promoted; keep the short index of every tool resident.
+        if tools is not None and len(tools) < len(self.tool_schemas):
+            system_prompt += f"\n\n{self.tool_summaries_str}"
+
         if current_interaction_turns:
             system_prompt += "\n\nCRITICAL INSTRUCTION: Analyze the results of the tool(s) you just used. Your previous turn resulted in new information. You must now decide whether to use another tool or to respond to the user with the information you have gathered."
         messages.append({"role": "system", "content": system_prompt})
@@ -129,8 +137,7 @@ class ThoughtProcessor:
         messages.append(user_message)
         messages.extend(current_interaction_turns)
 
-        # This part remains unchanged
-        response = await self._call_localai_llm(messages, tools=self.tool_schemas, max_tokens=max_tokens)
+        response = await self._call_localai_llm(messages, tools=tools if tools is not None else self.tool_schemas, max_tokens=max_tokens)
         
         if "error" in response: return {"type": "error", "content": f"Neko's brain fuzzy... {response['error']}"}
         try:
@@ -259,14 +266,12 @@ Facts:
 
     def _replace_aliases_with_user_id_format(self, text: str, upm: UserProfileManager) -> str:
         if not upm: return text
-        profiles = upm.get_all_user_profiles_for_mention_mapping()
-        modified_text = text
-        for name, user_id in profiles:
-            if name and user_id:
-                pattern = r'\b' + re.escape(name) + r'\b'
-                replacement_format = f"User (user_id: {user_id})"
-                modified_text = re.sub(pattern, replacement_format, modified_text, flags=re.IGNORECASE)
-        return modified_text
+        pattern, name_to_id = upm.get_mention_name_pattern()
+        if pattern is None: return text
+        def repl(m):
+            user_id = name_to_id.get(m.group(0).lower())
+            return f"User (user_id: {user_id})" if user_id else m.group(0)
+        return pattern.sub(repl, text)
 
     def _replace_user_id_format_with_aliases(self, text: str, upm: UserProfileManager) -> str:
         if not upm: return text
@@ -278,7 +283,17 @@ Facts:
             uid = m.group(1)
             if self.bot_user_id and uid == self.bot_user_id: return self.gen_name
             return upm.get_user_alias(uid) or m.group(0)
-        return re.sub(r'<@!?(\d+)>', repl, text)
+        return MENTION_RE.sub(repl, text)
+
+    def replace_mentions_with_aliases_cached(self, text: str, alias_map: dict[str, str]) -> str:
+        """Same as replace_mentions_with_aliases, but resolves IDs from a prebuilt {user_id: alias} map."""
+        if '<@' not in text: return text
+        bot_user_id, gen_name = self.bot_user_id, self.gen_name
+        def repl(m):
+            uid = m.group(1)
+            if bot_user_id and uid == bot_user_id: return gen_name
+            return alias_map.get(uid) or m.group(0)
+        return MENTION_RE.sub(repl, text)
 
     def replace_aliases_with_mentions(self, text: str, upm: UserProfileManager) -> str:
         if not upm: return text
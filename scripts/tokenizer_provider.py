@@ -0,0 +1,51 @@
+# tokenizer_provider.py
+
+import os
+import logging
+from functools import cached_property, lru_cache
+from pathlib import Path
+
+import sentencepiece as spm
+
+dev_logger = logging.getLogger('dev')
+
+TOKEN_COUNT_CACHE_SIZE = 4096
+
+class TokenizerProvider:
+    """
+    Loads the SentencePiece model on first use and hands the same processor to every manager.
+    `tokenizer` is None when the model is missing or fails to load; callers fall back to estimates.
+    """
+    def __init__(self, model_path: str = None):
+        self.model_path = Path(model_path or os.getenv('TOKENIZER_MODEL_PATH', 'models/tokenizer.model'))
+        # Per-instance so the cache is tied to this provider's tokenizer
+        self.count_tokens = lru_cache(maxsize=TOKEN_COUNT_CACHE_SIZE)(self._count_tokens)
+
+    @cached_property
+    def tokenizer(self):
+        try:
+            if self.model_path.exists():
+                tokenizer = spm.SentencePieceProcessor()
+                tokenizer.load(str(self.model_path))
+                dev_logger.info(f"SentencePiece tokenizer loaded from {self.model_path}.")
+                return tokenizer
+            dev_logger.warning(f"Tokenizer model not found at '{self.model_path}'. Token counts will be estimated.")
+        except Exception as e:
+            dev_logger.error(f"Failed to load SentencePiece tokenizer: {e}. Token counts will be estimated.", exc_info=True)
+        return None
+
+    def _count_tokens(self, text: str) -> int:
+        """Token count for `text`; len // 4 when no tokenizer is available. Use the cached `count_tokens`."""
+        tokenizer = self.tokenizer
+        if tokenizer:
+            return len(tokenizer.encode(text))
+        return len(text) // 4
+
+_shared_provider = None
+
+def get_tokenizer_provider() -> TokenizerProvider:
+    """Returns the process-wide TokenizerProvider."""
+    global _shared_provider
+    if _shared_provider is None:
+        _shared_provider = TokenizerProvider()
+    return _shared_provider
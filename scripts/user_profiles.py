@@ -1,6 +1,7 @@
 # user_profiles.py
 
 import os
+import re
 import json
 import logging
 from knowledge_graph import Neo4jManager
@@ -14,6 +15,9 @@ class UserProfileManager:
         self.gen_profile_path = gen_profile_path
         self._initialize_gen_profile()
         self.gen_profile = self.load_gen_profile()
+        # Mention pattern built from the last alias-mapping snapshot Neo4jManager handed out
+        self._mention_source = None
+        self._mention_pattern: tuple[re.Pattern | None, dict[str, str]] = (None, {})
 
     def _initialize_gen_profile(self):
         """Create gen_profile.json with defaults if it doesn't exist."""
@@ -157,6 +161,15 @@ class UserProfileManager:
         dev_logger.warning(f"get_user_alias: User with ID '{user_id_str}' not found in Neo4j. Cannot retrieve alias.")
         return None 
 
+    def get_aliases_bulk(self, user_ids) -> dict[str, str]:
+        """Get preferred aliases for several users in one Neo4j round trip. Unknown users are omitted."""
+        users = self.neo4j_manager.get_users([str(user_id) for user_id in user_ids])
+        aliases = {}
+        for user_id, user in users.items():
+            alias = user.get('alias')
+            aliases[user_id] = alias if alias and alias.strip() else user.get('username')
+        return aliases
+
     def get_user_by_name(self, name: str):
         """Find a user by their current alias or one of their other_names, returning user_id."""
         # This method seems fine as is, assuming Neo4jManager.get_user_by_name searches correctly.
@@ -198,13 +211,14 @@ class UserProfileManager:
         user_id_str = str(user_id)
         return self.gen_profile.get("relationships", {}).get(user_id_str, "neutral")
 
-    def get_all_user_profiles_for_mention_mapping(self) -> list[tuple[str, str]]:
+    def get_all_user_profiles_for_mention_mapping(self, raw_users_data: list[dict] = None) -> list[tuple[str, str]]:
         """
         Retrieves all known names (aliases, other_names, usernames) and their corresponding Discord user_ids.
         This list is sorted by name length (descending) to ensure longer names are replaced first.
         Returns a list of tuples: [(name_to_replace: str, user_id: str)].
         """
-        raw_users_data = self.neo4j_manager.get_all_users_for_alias_mapping()
+        if raw_users_data is None:
+            raw_users_data = self.neo4j_manager.get_all_users_for_alias_mapping()
         # Using a set to store (name, user_id) tuples to ensure uniqueness of name-ID pairs before sorting.
         # This handles cases where a username might be the same as an alias or an other_name for the same user.
         unique_name_id_pairs = set()
@@ -246,3 +260,24 @@ class UserProfileManager:
         
         dev_logger.debug(f"Prepared {len(mention_map_list_sorted)} unique name-to-ID mappings for mention replacement, sorted by length.")
         return mention_map_list_sorted
+
+    def get_mention_name_pattern(self) -> tuple[re.Pattern | None, dict[str, str]]:
+        """
+        Returns one compiled pattern matching any known name (longest names first) and a
+        {lowercased name: user_id} map for resolving matches. Rebuilt only when the cached
+        alias mapping from Neo4jManager changes. The pattern is None when no names are known.
+        """
+        raw_users_data = self.neo4j_manager.get_all_users_for_alias_mapping()
+        if raw_users_data is self._mention_source:
+            return self._mention_pattern
+        name_to_id = {}
+        for name, user_id in self.get_all_user_profiles_for_mention_mapping(raw_users_data):
+            # A name shared by several users resolves to the first one in longest-first order
+            name_to_id.setdefault(name.lower(), user_id)
+        pattern = None
+        if name_to_id:
+            alternatives = sorted(name_to_id, key=len, reverse=True)
+            pattern = re.compile(r'\b(?:' + '|'.join(map(re.escape, alternatives)) + r')\b', re.IGNORECASE)
+        self._mention_source = raw_users_data
+        self._mention_pattern = (pattern, name_to_id)
+        return self._mention_pattern